@@ -1,7 +1,17 @@
 from .pool import Pool, Group
 from .bag import Bag, OrderedBag
 from .yielder import Yielder, OrderedYielder, yielding, ordered_yielding
+from .runner import LoopRunner
+from .limiter import AdaptiveLimiter, KeyedLimiter
+from .limiter import TokenBucket, KeyedTokenBucket, PriorityLimiter
+from .limiter import FairLimiter
+from .sharded import ShardedPool, ShardedYielder
+from .pipeline import Pipeline
+from .stats import Stats
 
 __all__ = ['Pool', 'Group', 'Bag', 'OrderedBag',
-           'Yielder', 'OrderedYielder', 'yielding', 'ordered_yielding']
+           'Yielder', 'OrderedYielder', 'yielding', 'ordered_yielding',
+           'LoopRunner', 'ShardedPool', 'ShardedYielder', 'Pipeline', 'Stats',
+           'AdaptiveLimiter', 'KeyedLimiter', 'TokenBucket',
+           'KeyedTokenBucket', 'PriorityLimiter', 'FairLimiter']
 __version__ = '0.3.10'
@@ -5,15 +5,16 @@
 This is old implementation for yielding helper
 You should use Yielder and OrderedYielder instead
 """
-import time
+import heapq
 import queue
-import inspect
 import asyncio
-import functools
 import threading
 
 from .pool import Group
 
+# put by the schedule thread when it is done
+_DONE = object()
+
 
 class Bag(object):
 
@@ -21,7 +22,8 @@ class Bag(object):
 
     A Bag is just a Group, a queue, and a background thread running event loop.
     Coroutines are spawned in a schedule method, and enqueues result to the
-    queue, main thread then yield items from queue.
+    queue, main thread then yield items from queue, blocking on it until an
+    item arrives or the schedule thread ends.
 
     Usage::
 
@@ -50,10 +52,11 @@ class Bag(object):
         else:
             try:
                 self.loop = asyncio.get_event_loop()
-                if self.loop.is_running():
-                    raise NotImplementedError("Cannot use aioutils in "
-                                            "asynchroneous environment")
             except:
+                self.loop = None
+            if self.loop is None or self.loop.is_running():
+                # the loop is run by the schedule thread, never share a
+                # running one, use Yielder for async callers
                 self.loop = asyncio.new_event_loop()
                 asyncio.set_event_loop(self.loop)
             self.g = Group(loop=self.loop)
@@ -72,17 +75,31 @@ class Bag(object):
     def schedule(self, schedule):
         def schedule_wrapper(loop):
             asyncio.set_event_loop(loop)
-            schedule()
+            try:
+                schedule()
+            finally:
+                # wakes up the consumer for good
+                self.q.put(_DONE)
 
         self.t = threading.Thread(target=schedule_wrapper, args=(self.loop,))
         self.t.start()
 
+    def _items(self):
+        """ Queued items, until the schedule thread is done """
+        if self.t is None:
+            while True:
+                try:
+                    yield self.q.get_nowait()
+                except queue.Empty:
+                    return
+        while True:
+            item = self.q.get()
+            if item is _DONE:
+                return
+            yield item
+
     def yielder(self):
-        while (self.t and self.t.is_alive()) or (self.q.qsize() > 0):
-            try:
-                yield self.q.get_nowait()
-            except:
-                time.sleep(0.1)
+        yield from self._items()
 
 
 class OrderedBag(Bag):
@@ -91,38 +108,35 @@ class OrderedBag(Bag):
 
     def __init__(self, *args):
         super(OrderedBag, self).__init__(*args)
-        self.q = queue.PriorityQueue()
         self.order = 0
+        # task -> spawning order, while the task runs
+        self.orders = {}
 
     def spawn(self, coro):
         self.order += 1
-
-        def _coro_wrapper(order):
-            yield from coro
-        return self.g.spawn(functools.partial(_coro_wrapper, self.order)())
+        task = self.g.spawn(coro)
+        self.orders[task] = self.order
+        task.add_done_callback(self.orders.pop)
+        return task
 
     def put(self, item):
         order = self._get_coro_order()
         self.q.put((order, item))
 
     def _get_coro_order(self):
-        """ Get the coro (and its order) of self """
-        stack = inspect.stack()
-        for frame, module, line, function, context, index in stack:
-            if function == '_coro_wrapper':
-                return frame.f_locals['order']
+        """ Get the order of the task calling put """
+        task = asyncio.Task.current_task(loop=self.loop)
+        return self.orders.get(task)
 
-    def yielder(self):
+    def yielder(self, heappush=heapq.heappush, heappop=heapq.heappop):
+        done = []
         next_order = 1
-        while (self.t and self.t.is_alive()) or (self.q.qsize() > 0):
-            try:
-                # peek item, the smallest of heap
-                order, item = self.q.queue[0]
-                if order != next_order:
-                    time.sleep(0.03)
-                else:
-                    order, item = self.q.get_nowait()
-                    next_order += 1
-                    yield item
-            except IndexError:
-                time.sleep(0.03)
+        for seq, (order, item) in enumerate(self._items()):
+            heappush(done, (order, seq, item))
+            while done and done[0][0] <= next_order:
+                yield heappop(done)[2]
+                next_order += 1
+        # the schedule thread is done, nothing else will fill the gaps
+        while done:
+            yield heappop(done)[2]
+
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Request coalescing (singleflight) and a result cache
+
+Used by `spawn(..., cache_key=...)` of Pool and Yielder: while a task of a
+cache_key is running, spawning the same cache_key again just waits for its
+result instead of doing the work twice, and with a cache, results are kept
+for `cache_ttl` seconds so that no task is scheduled at all.
+"""
+import time
+import asyncio
+import functools
+import collections
+
+
+class ResultCache(object):
+
+    """ Bounded LRU of results, expiring after `ttl` seconds if set """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        """ Return (hit, value) """
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        value, expires = entry
+        if expires is not None and expires < time.monotonic():
+            del self.entries[key]
+            return False, None
+        self.entries.move_to_end(key)
+        return True, value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        self.entries[key] = (value, expires)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+class SingleFlight(object):
+
+    """ One task in flight per key, optionally caching its result """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.flights = {}
+
+    def cached(self, key):
+        """ Return (hit, value) """
+        if self.cache is None:
+            return False, None
+        return self.cache.get(key)
+
+    def get(self, key):
+        """ The task in flight for key, or None """
+        return self.flights.get(key)
+
+    def lead(self, key, task):
+        self.flights[key] = task
+        task.add_done_callback(functools.partial(self._landed, key))
+
+    def _landed(self, key, task):
+        if self.flights.get(key) is task:
+            del self.flights[key]
+        if self.cache is not None and not task.cancelled() and \
+                task.exception() is None:
+            self.cache.set(key, task.result())
+
+    @asyncio.coroutine
+    def follow(self, task, loop=None):
+        # a cancelled follower must not cancel the leader
+        return (yield from asyncio.shield(task, loop=loop))
+
+
+def close_coro(coro):
+    """ Close coro if it's a coroutine that won't be run """
+    if asyncio.iscoroutine(coro):
+        coro.close()
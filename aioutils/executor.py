@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Run blocking callables as coroutines
+
+Used by spawn_blocking of Group, Pool and Yielder, so that blocking work
+(DB drivers, compression, legacy SDKs) counts against the same limits and
+joins/yields with the coroutines.
+"""
+import asyncio
+import functools
+
+
+@asyncio.coroutine
+def run_blocking(loop, executor, fn, args):
+    """ Run fn(*args) in executor (None for the loop default) """
+    return (yield from loop.run_in_executor(executor,
+                                            functools.partial(fn, *args)))
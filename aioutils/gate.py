@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" The gates a spawned coroutine passes before it runs
+
+Shared by Pool and Yielder: stats, rate quota, pool slot (by priority if
+asked), per key rate quota and per key slot, each of them optional.
+"""
+import asyncio
+import functools
+
+
+class Gated(object):
+
+    """ Mixin wrapping coroutines in the limits of a pool
+
+    Expects the attributes `loop`, `metrics`, `bucket`, `sem`,
+    `key_bucket`, `keyed` and `latencies`, limits may be None.
+    """
+
+    def _gated(self, coro, key=None, policy=None, priority=None):
+        """ coro, or a coroutine function with a retry policy, gated """
+        if policy is not None:
+            # every attempt passes the gates on its own
+            gate = functools.partial(self._gate, key=key, priority=priority)
+            return policy.wrap(coro, gate, self.latencies, self.loop)
+        if not asyncio.iscoroutine(coro) and callable(coro):
+            coro = coro()
+        return self._gate(coro, key, priority)
+
+    def _gate(self, coro, key=None, priority=None):
+        # gates run outermost first: key slot, key rate, rate, slot, so
+        # that no slot is held while waiting for a token
+        if self.metrics is not None:
+            coro = self.metrics.track(coro)
+        if self.sem is not None and priority is not None:
+            coro = self._priority_coro(coro, priority)
+        elif self.sem is not None:
+            coro = self._limit_coro(coro)
+        if self.bucket is not None:
+            coro = self._rate_coro(coro, self.bucket)
+        if key is not None and self.key_bucket is not None:
+            coro = self._rate_coro(coro, self.key_bucket, key)
+        if key is not None and self.keyed is not None:
+            coro = self._key_coro(coro, key)
+        return coro
+
+    def _gate_pulled(self, coro):
+        """ Gates of a coroutine pulled by a worker (map, spawn_many),
+        which took its token with _wait_rate and holds its slot already
+        """
+        if self.metrics is not None:
+            coro = self.metrics.track(coro)
+        return coro
+
+    @asyncio.coroutine
+    def _wait_rate(self):
+        """ Take a token of the rate quota, before taking a slot """
+        if self.bucket is not None:
+            yield from self.bucket.acquire()
+
+    def _worker_sem(self, workers):
+        """ The slots spawn_many workers take, the pool's own if any """
+        if self.sem is not None:
+            return self.sem
+        return asyncio.Semaphore(workers, loop=self.loop)
+
+    @asyncio.coroutine
+    def _limit_coro(self, coro):
+        with (yield from self.sem):
+            return (yield from coro)
+
+    @asyncio.coroutine
+    def _priority_coro(self, coro, priority):
+        with (yield from self.sem.slot(priority)):
+            return (yield from coro)
+
+    @asyncio.coroutine
+    def _key_coro(self, coro, key):
+        with (yield from self.keyed.slot(key)):
+            return (yield from coro)
+
+    @asyncio.coroutine
+    def _rate_coro(self, coro, bucket, *key):
+        yield from bucket.acquire(*key)
+        return (yield from coro)
@@ -0,0 +1,545 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Limiters: drop-in replacements of asyncio.Semaphore for pools
+
+A limiter is used exactly like a semaphore::
+
+    with (yield from limiter):
+        ...
+
+and can be passed as the `pool_size` of a Yielder. TokenBucket limits the
+rate instead of the concurrency, and is passed as `rate`.
+"""
+import heapq
+import asyncio
+import itertools
+import collections
+
+
+class _Slot(object):
+
+    """ Context manager returned by `yield from limiter` """
+
+    def __init__(self, limiter, start):
+        self.limiter = limiter
+        self.start = start
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        self.limiter.release(self, exc)
+
+
+class AdaptiveLimiter(object):
+
+    """ A semaphore whose size adapts to observed latency and errors
+
+    Additive increase, multiplicative decrease (AIMD): every task that
+    finishes without error, and within `target_latency` seconds if set,
+    grows the limit by 1/limit (so about one more slot per round of tasks),
+    up to `max_size`. An error, or a task slower than `target_latency`,
+    multiplies the limit by `backoff`, down to `min_size`. Tasks started
+    before the last decrease don't decrease it again, so that a burst of
+    failures only backs off once.
+
+    `limit` is the current concurrency limit, `active` the slots in use.
+    """
+
+    def __init__(self, min_size=1, max_size=None, initial=None,
+                 target_latency=None, backoff=0.5, loop=None):
+        self.min_size = min_size
+        self.max_size = max_size or float('inf')
+        self.limit = float(initial or min_size)
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.loop = loop
+        self.active = 0
+        self.waiters = collections.deque()
+        self.last_decrease = 0
+
+    def _time(self):
+        return (self.loop or asyncio.get_event_loop()).time()
+
+    def locked(self):
+        return self.active >= int(self.limit)
+
+    @asyncio.coroutine
+    def acquire(self):
+        if self.locked() or self.waiters:
+            waiter = asyncio.Future(loop=self.loop)
+            self.waiters.append(waiter)
+            try:
+                yield from waiter
+            except asyncio.CancelledError:
+                if not waiter.cancelled():
+                    # granted, but we are gone
+                    self.release()
+                raise
+        else:
+            self.active += 1
+        return True
+
+    def release(self, slot=None, exc=None):
+        """ Give back a slot, with feedback if released by a _Slot """
+        self.active -= 1
+        if slot is not None and not isinstance(exc, asyncio.CancelledError):
+            self._adjust(slot.start, exc)
+        self._wake()
+
+    def _adjust(self, start, exc):
+        now = self._time()
+        slow = (self.target_latency is not None and
+                now - start > self.target_latency)
+        if exc is None and not slow:
+            self.limit = min(self.max_size, self.limit + 1.0 / self.limit)
+        elif start >= self.last_decrease:
+            self.limit = max(self.min_size, self.limit * self.backoff)
+            self.last_decrease = now
+
+    def _wake(self):
+        while self.waiters and self.active < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.active += 1
+
+    def __iter__(self):
+        yield from self.acquire()
+        return _Slot(self, self._time())
+
+
+class _KeyState(object):
+
+    __slots__ = ('active', 'waiters')
+
+    def __init__(self):
+        self.active = 0
+        self.waiters = None
+
+
+class _KeySlot(object):
+
+    def __init__(self, limiter, key):
+        self.limiter = limiter
+        self.key = key
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        self.limiter.release(self.key)
+
+
+class KeyedLimiter(object):
+
+    """ Per key concurrency limits, e.g. politeness limits per host
+
+    Each key gets `size` slots, or `sizes[key]` if present (None means no
+    limit for that key). State is only kept for keys in use, and dropped as
+    soon as a key is idle, so that millions of distinct keys don't leak.
+
+    Usage::
+
+        with (yield from limiter.slot(key)):
+            ...
+    """
+
+    def __init__(self, size=None, sizes=None, loop=None):
+        self.size = size
+        self.sizes = sizes or {}
+        self.loop = loop
+        self.keys = {}
+
+    def limit(self, key):
+        return self.sizes.get(key, self.size)
+
+    @asyncio.coroutine
+    def acquire(self, key):
+        limit = self.limit(key)
+        if limit is None:
+            return True
+        state = self.keys.get(key)
+        if state is None:
+            state = self.keys[key] = _KeyState()
+        if state.active < limit and not state.waiters:
+            state.active += 1
+            return True
+
+        if state.waiters is None:
+            state.waiters = collections.deque()
+        waiter = asyncio.Future(loop=self.loop)
+        state.waiters.append(waiter)
+        try:
+            yield from waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                if waiter in state.waiters:
+                    state.waiters.remove(waiter)
+                self._evict(key, state)
+            else:
+                # granted, but we are gone
+                self.release(key)
+            raise
+        return True
+
+    def release(self, key):
+        limit = self.limit(key)
+        if limit is None:
+            return
+        state = self.keys[key]
+        state.active -= 1
+        waiters = state.waiters
+        while waiters and state.active < limit:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                state.active += 1
+        self._evict(key, state)
+
+    def _evict(self, key, state):
+        if not state.active and not state.waiters \
+                and self.keys.get(key) is state:
+            del self.keys[key]
+
+    @asyncio.coroutine
+    def slot(self, key):
+        yield from self.acquire(key)
+        return _KeySlot(self, key)
+
+
+class TokenBucket(object):
+
+    """ Rate limit: admit `rate` acquires per second, bursts of `burst`
+
+    Tokens refill continuously up to `burst` (default 1, a steady rate).
+    Waiters are queued in order and woken by a single timer armed for the
+    next token, instead of each of them sleeping on its own.
+
+    Usage::
+
+        yield from bucket.acquire()
+    """
+
+    def __init__(self, rate, burst=None, loop=None):
+        self.rate = float(rate)
+        self.burst = burst or 1
+        self.loop = loop
+        self.tokens = float(self.burst)
+        self.stamp = None
+        self.waiters = collections.deque()
+        self.timer = None
+
+    def _time(self):
+        return (self.loop or asyncio.get_event_loop()).time()
+
+    def _refill(self):
+        now = self._time()
+        if self.stamp is not None:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def full(self):
+        """ Whether the bucket is idle and as good as a fresh one """
+        self._refill()
+        return self.tokens >= self.burst and not self.waiters
+
+    @asyncio.coroutine
+    def acquire(self):
+        self._refill()
+        if self.tokens >= 1 and not self.waiters:
+            self.tokens -= 1
+            return True
+
+        waiter = asyncio.Future(loop=self.loop)
+        self.waiters.append(waiter)
+        self._arm()
+        try:
+            yield from waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+            else:
+                # granted, but we are gone
+                self.tokens = min(self.burst, self.tokens + 1)
+                self._wake()
+            raise
+        return True
+
+    def _arm(self):
+        if self.timer is None and self.waiters:
+            delay = max(0, (1 - self.tokens) / self.rate)
+            loop = self.loop or asyncio.get_event_loop()
+            self.timer = loop.call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self.timer = None
+        self._wake()
+
+    def _wake(self):
+        self._refill()
+        waiters = self.waiters
+        while waiters and self.tokens >= 1:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.tokens -= 1
+        self._arm()
+
+    def __iter__(self):
+        yield from self.acquire()
+        return _NoopSlot()
+
+
+class _NoopSlot(object):
+
+    """ Tokens are spent, not given back """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return None
+
+
+class KeyedTokenBucket(object):
+
+    """ A TokenBucket per key, e.g. requests per second per host
+
+    Full buckets are dropped every `sweep` acquires, so that millions of
+    distinct keys don't leak.
+    """
+
+    def __init__(self, rate, burst=None, loop=None, sweep=1024):
+        self.rate = rate
+        self.burst = burst
+        self.loop = loop
+        self.sweep = sweep
+        self.buckets = {}
+        self.acquires = 0
+
+    @asyncio.coroutine
+    def acquire(self, key):
+        self.acquires += 1
+        if self.acquires % self.sweep == 0:
+            self._sweep()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst,
+                                                     loop=self.loop)
+        return (yield from bucket.acquire())
+
+    def _sweep(self):
+        for key, bucket in list(self.buckets.items()):
+            if bucket.full():
+                del self.buckets[key]
+
+
+class _ReleaseSlot(object):
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        self.limiter.release()
+
+
+class PriorityLimiter(object):
+
+    """ A semaphore granting slots by priority instead of FIFO
+
+    Lower priorities go first, like heapq, FIFO among equals. With `aging`,
+    a waiter gains `aging` priority per second spent waiting, so that low
+    priority work can't starve.
+
+    Usage::
+
+        with (yield from limiter.slot(priority)):
+            ...
+
+    Waiters are kept in a heap of (rank, seq, future) tuples, cancelled
+    ones are skipped when they surface.
+    """
+
+    def __init__(self, size, aging=0, loop=None):
+        self.size = size
+        self.aging = aging
+        self.loop = loop
+        self.active = 0
+        self.waiters = []
+        self.seq = itertools.count()
+
+    def locked(self):
+        return self.active >= self.size
+
+    @asyncio.coroutine
+    def acquire(self, priority=0, heappush=heapq.heappush):
+        if self.active < self.size and not self.waiters:
+            self.active += 1
+            return True
+
+        rank = priority
+        if self.aging:
+            # waiting ages everyone alike, so the rank never changes
+            loop = self.loop or asyncio.get_event_loop()
+            rank += self.aging * loop.time()
+        waiter = asyncio.Future(loop=self.loop)
+        heappush(self.waiters, (rank, next(self.seq), waiter))
+        # a free slot may be left behind by cancelled waiters
+        self._wake()
+        try:
+            yield from waiter
+        except asyncio.CancelledError:
+            if not waiter.cancelled():
+                # granted, but we are gone
+                self.release()
+            raise
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self, heappop=heapq.heappop):
+        waiters = self.waiters
+        while waiters and self.active < self.size:
+            waiter = heappop(waiters)[2]
+            if not waiter.done():
+                waiter.set_result(None)
+                self.active += 1
+
+    @asyncio.coroutine
+    def slot(self, priority=0):
+        yield from self.acquire(priority)
+        return _ReleaseSlot(self)
+
+    def __iter__(self):
+        yield from self.acquire()
+        return _ReleaseSlot(self)
+
+
+class _Flow(object):
+
+    __slots__ = ('name', 'weight', 'vtime', 'waiters')
+
+    def __init__(self, name, weight):
+        self.name = name
+        self.weight = weight
+        self.vtime = 0.0
+        self.waiters = collections.deque()
+
+
+class _FlowLimiter(object):
+
+    """ The semaphore-like view of one flow of a FairLimiter """
+
+    def __init__(self, limiter, flow):
+        self.limiter = limiter
+        self.flow = flow
+
+    def locked(self):
+        return self.limiter.locked()
+
+    @asyncio.coroutine
+    def acquire(self):
+        return (yield from self.limiter.acquire(self.flow.name))
+
+    def release(self):
+        self.limiter.release()
+
+    def __iter__(self):
+        yield from self.limiter.acquire(self.flow.name)
+        return _ReleaseSlot(self.limiter)
+
+
+class FairLimiter(object):
+
+    """ A semaphore shared by weighted flows, with weighted fair queuing
+
+    Under contention, a flow of weight 2 gets twice the slots of a flow of
+    weight 1, whoever spawns more. Each flow has a virtual time, advanced
+    by 1/weight per slot granted, and the next free slot goes to the
+    waiting flow with the lowest one. A flow coming back from idle starts
+    at the current virtual time, so idleness is not banked as credit.
+
+    `flow(name, weight)` returns a semaphore-like object for one flow, the
+    limiter itself acquires for the default flow (None).
+    """
+
+    def __init__(self, size, loop=None):
+        self.size = size
+        self.loop = loop
+        self.active = 0
+        self.vtime = 0.0
+        self.flows = {}
+        # flows with waiters, by virtual time
+        self.ready = []
+        self.seq = itertools.count()
+
+    def flow(self, name, weight=1):
+        flow = self.flows.get(name)
+        if flow is None:
+            flow = self.flows[name] = _Flow(name, weight)
+        flow.weight = weight
+        return _FlowLimiter(self, flow)
+
+    def locked(self):
+        return self.active >= self.size
+
+    def _grant(self, flow):
+        start = max(flow.vtime, self.vtime)
+        self.vtime = start
+        flow.vtime = start + 1.0 / flow.weight
+        self.active += 1
+
+    @asyncio.coroutine
+    def acquire(self, name=None, heappush=heapq.heappush):
+        flow = self.flows.get(name)
+        if flow is None:
+            flow = self.flow(name).flow
+        if self.active < self.size and not self.ready:
+            self._grant(flow)
+            return True
+
+        waiter = asyncio.Future(loop=self.loop)
+        if not flow.waiters:
+            flow.vtime = max(flow.vtime, self.vtime)
+            heappush(self.ready, (flow.vtime, next(self.seq), flow))
+        flow.waiters.append(waiter)
+        # a free slot may be left behind by cancelled waiters
+        self._wake()
+        try:
+            yield from waiter
+        except asyncio.CancelledError:
+            if not waiter.cancelled():
+                # granted, but we are gone
+                self.release()
+            raise
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self, heappush=heapq.heappush, heappop=heapq.heappop):
+        ready = self.ready
+        while ready and self.active < self.size:
+            flow = heappop(ready)[2]
+            waiters = flow.waiters
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    self._grant(flow)
+                    break
+            if waiters:
+                heappush(ready, (flow.vtime, next(self.seq), flow))
+
+    def __iter__(self):
+        yield from self.acquire()
+        return _ReleaseSlot(self)
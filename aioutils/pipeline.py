@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Pipeline: chain coroutine functions, each stage with its own pool
+
+Usage::
+
+>>> p = Pipeline()
+>>> p.stage(fetch, concurrency=100)
+>>> p.stage(parse, concurrency=4, ordered=True)
+>>> p.stage(store, concurrency=10, buffer=50)
+>>> for result in p.yielding(urls):
+...     print(result)
+
+Every stage is a Yielder (an OrderedYielder if `ordered`) mapping its
+function over the results of the previous stage, in the same loop, so all
+stages run at once. A stage keeps at most `buffer` results (2 x its
+concurrency by default) running or waiting for the next stage, so the
+slowest stage holds the others back instead of piling up results.
+"""
+from .yielder import Yielder, OrderedYielder
+
+
+class Pipeline(object):
+
+    def __init__(self, loop=None, runner=None):
+        self.loop = loop
+        self.runner = runner
+        self.stages = []
+
+    def stage(self, func, concurrency=1, ordered=False, buffer=None):
+        """ Add a stage calling func(result of the previous stage) """
+        self.stages.append((func, concurrency, ordered, buffer))
+        return self
+
+    def _start(self, inputs):
+        if not self.stages:
+            raise ValueError('pipeline has no stage')
+        loop = self.loop
+        source = inputs
+        yielders = []
+        last = len(self.stages) - 1
+        for i, (func, concurrency, ordered, buffer) in enumerate(self.stages):
+            cls = OrderedYielder if ordered else Yielder
+            # the next stage pulls one by one, results not pulled yet stay
+            # in the buffer, taking room
+            y = cls(concurrency, max_buffered=buffer or 2 * concurrency,
+                    max_batch=1 if i < last else None, loop=loop,
+                    runner=self.runner)
+            # a plain iterable first, then the previous stage (async)
+            results = y.map(func, source)
+            loop = y.loop
+            source = y
+            yielders.append(y)
+        return yielders, results
+
+    def yielding(self, inputs):
+        """ Feed inputs to the first stage, yield results of the last one
+
+        Inside a running loop, the last stage is returned instead, to be
+        consumed with `async for`.
+        """
+        yielders, results = self._start(inputs)
+        if yielders[-1].native:
+            return results
+        return self._consume(yielders, results)
+
+    def _consume(self, yielders, results):
+        try:
+            yield from results
+        except GeneratorExit:
+            # the last stage cleaned up after itself, stop the others
+            for y in yielders[:-1]:
+                y._call(y._cancel_pending)
+                y._call(y._prepare)
+            raise
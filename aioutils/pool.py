@@ -20,21 +20,66 @@ Usage::
 >>> for _ in range(10):
 ...     p.async(f('http://www.baidu.com'))
 >>> p.join()
+
+>>> # or pull inputs lazily and get the results back
+>>> for content in p.imap(f, urls):
+...     print(content)
 """
 import asyncio
 
+from .gate import Gated
+from .yielder import Yielder, OrderedYielder
+from .limiter import AdaptiveLimiter, KeyedLimiter
+from .limiter import TokenBucket, KeyedTokenBucket, PriorityLimiter
+from .limiter import FairLimiter
+from .retry import Latencies, RetryPolicy
+from .cache import ResultCache, SingleFlight, close_coro
+from .executor import run_blocking
+from .stats import Stats
+from .runner import Inbox
+
 
 class Group(object):
 
-    def __init__(self, loop=None):
-        try:
-            self.loop = loop or asyncio.get_event_loop()
-            if self.loop.is_running():
-                raise NotImplementedError("Cannot use aioutils in "
-                                          "asynchroneous environment")
-        except:
-            self.loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(self.loop)
+    """ Spawn coroutines and join them later
+
+    Pass a `LoopRunner` as `runner` to run the coroutines in its long-lived
+    loop thread, instead of starting and stopping the loop of the calling
+    thread on every join.
+
+    Use `spawn_blocking` for blocking functions, they are run in `executor`
+    (a ThreadPoolExecutor or ProcessPoolExecutor, None for the loop default)
+    and joined just like coroutines.
+
+    Created inside a running loop (i.e. in a coroutine), the group spawns
+    into that loop and `join` must be awaited, or use `async with`.
+
+    With `stats=True` (or a Stats instance, e.g. shared or with hooks),
+    task waits, run times and loop lag are recorded, see `stats()`.
+
+    Other threads spawn with `spawn_threadsafe`, which hands the coroutine
+    to the loop (woken up once per batch), `join` waits for those too.
+    """
+
+    def __init__(self, loop=None, runner=None, executor=None, stats=None):
+        self.runner = runner
+        self.executor = executor
+        self.metrics = Stats() if stats is True else (stats or None)
+        if runner is not None:
+            self.loop = runner.loop
+        else:
+            try:
+                self.loop = loop or asyncio.get_event_loop()
+            except:
+                self.loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self.loop)
+        # created inside a running loop: awaited there, not run
+        self.native = runner is None and self.loop.is_running()
+        if self.metrics is not None and self.native:
+            self.metrics.watch(self.loop)
+        elif self.metrics is not None and runner is not None:
+            self.loop.call_soon_threadsafe(self.metrics.watch, self.loop)
+        self.inbox = Inbox(self.loop, self._maybe_done)
         self._prepare()
 
     def _prepare(self):
@@ -42,21 +87,54 @@ class Group(object):
         self.task_waiter = asyncio.futures.Future(loop=self.loop)
 
     def spawn(self, coro_or_future):
+        if self.runner is not None and not self.runner.in_loop():
+            return self.runner.call(self.spawn, coro_or_future)
+        if self.metrics is not None and asyncio.iscoroutine(coro_or_future):
+            coro_or_future = self.metrics.track(coro_or_future)
+        return self._spawn_task(coro_or_future)
+
+    async = spawn
+
+    def spawn_threadsafe(self, coro, **options):
+        """ Spawn from any thread, options are those of spawn """
+        self.inbox.submit(self.spawn, coro, **options)
+
+    def _spawn_task(self, coro_or_future):
         self.counter += 1
-        task = asyncio.async(coro_or_future)
+        task = asyncio.async(coro_or_future, loop=self.loop)
         task.add_done_callback(self._on_completion)
         return task
 
-    async = spawn
+    def spawn_blocking(self, fn, *args):
+        """ Spawn fn(*args), running in the executor """
+        return self.spawn(run_blocking(self.loop, self.executor, fn, args))
 
     def _on_completion(self, f):
         self.counter -= 1
         f.remove_done_callback(self._on_completion)
-        if self.counter <= 0:
+        self._maybe_done()
+
+    def _maybe_done(self):
+        # calls in the inbox may still spawn
+        if self.counter <= 0 and not self.inbox:
             if not self.task_waiter.done():
                 self.task_waiter.set_result(None)
 
+    def stats(self):
+        """ A snapshot of the metrics (a dict), None without `stats` """
+        if self.metrics is None:
+            return None
+        return self.metrics.snapshot(in_flight=self.counter)
+
     def join(self):
+        if self.native:
+            return _Join(self._join_native(), self.loop)
+        if self.runner is not None:
+            if self.runner.in_loop():
+                raise RuntimeError('Cannot join in the loop thread')
+            self.runner.call(self._wait_all).result()
+            return
+
         def _on_waiter(f):
             self.loop.stop()
             self._prepare()
@@ -64,28 +142,262 @@ class Group(object):
         self.task_waiter.add_done_callback(_on_waiter)
 
         # expect the loops to be stop and start multiple times
-        while self.counter > 0:
+        while self.counter > 0 or self.inbox:
             if not self.loop.is_running():
                 self.loop.run_forever()
 
+    def _wait_all(self):
+        """ Future resolved when all spawned tasks are done (runner mode) """
+        if self.counter <= 0 and not self.inbox:
+            return None
+        if self.task_waiter.done():
+            self.task_waiter = asyncio.futures.Future(loop=self.loop)
+        return self.task_waiter
 
-class Pool(Group):
+    @asyncio.coroutine
+    def _join_native(self):
+        while self.counter > 0 or self.inbox:
+            yield from self._wait_all()
 
-    def __init__(self, pool_size, loop=None):
-        self.sem = asyncio.Semaphore(pool_size, loop=loop)
-        super(Pool, self).__init__(loop)
+    @asyncio.coroutine
+    def __aenter__(self):
+        return self
 
-    def spawn(self, coro):
-        assert asyncio.iscoroutine(coro), 'pool only accepts coroutine'
+    @asyncio.coroutine
+    def __aexit__(self, *args):
+        yield from self._join_native()
 
-        @asyncio.coroutine
-        def _limit_coro():
-            with (yield from self.sem):
-                return (yield from coro)
 
-        self.counter += 1
-        task = asyncio.async(_limit_coro())
-        task.add_done_callback(self._on_completion)
-        return task
+class _Join(object):
+
+    """ join() of a native group, to be awaited
+
+    Called without await, it would silently never run, so that is reported
+    to the loop exception handler when it is dropped.
+    """
+
+    def __init__(self, coro, loop):
+        self.coro = coro
+        self.loop = loop
+        self.awaited = False
+
+    def __iter__(self):
+        self.awaited = True
+        return (yield from self.coro)
+
+    __await__ = __iter__
+
+    def __del__(self):
+        if not self.awaited:
+            self.coro.close()
+            self.loop.call_exception_handler({
+                'message': 'join() of a group created inside a running '
+                           'loop was never awaited',
+            })
+
+
+class Pool(Gated, Group):
+
+    """ A Group limiting the number of concurrent coroutines
+
+    With `adaptive`, the limit is resized at runtime by an AdaptiveLimiter
+    between `min_size` and `max_size`, starting from `pool_size` (or
+    `min_size`), backing off on errors and tasks slower than
+    `target_latency` seconds. `size` is the current limit.
+
+    `spawn(coro, key=...)` limits tasks of the same key (e.g. a host) to
+    `key_size`, or `key_sizes[key]`, the overall `pool_size` is then
+    optional.
+
+    `rate` limits task starts to `rate` per second, with bursts of `burst`
+    (1 by default), `key_rate` and `key_burst` do the same per key.
+
+    `spawn` also takes `timeout`, `retries`, `backoff` and `hedge_after`,
+    see RetryPolicy, and `cache_key`: tasks of a cache_key spawned while one
+    is running share its result, and with `cache_size` results are cached
+    for `cache_ttl` seconds, returned in a done future with no task at all.
+
+    With `prioritized`, `spawn(coro, priority=n)` gets a slot by priority
+    (lower first) instead of FIFO, waiting tasks gain `aging` priority per
+    second so that none starves.
+
+    With `fair`, independent jobs can share the pool through child groups,
+    `pool.group(name, weight)`, which get slots by weighted fair queuing.
+    """
+
+    def __init__(self, pool_size=None, loop=None, runner=None,
+                 executor=None, adaptive=False, min_size=1, max_size=None,
+                 target_latency=None, key_size=None, key_sizes=None,
+                 rate=None, burst=None, key_rate=None, key_burst=None,
+                 cache_size=None, cache_ttl=None, prioritized=False,
+                 aging=0, fair=False, stats=None):
+        if runner is not None:
+            loop = runner.loop
+        if adaptive:
+            self.sem = AdaptiveLimiter(min_size, max_size, pool_size,
+                                       target_latency, loop=loop)
+        elif pool_size is not None and fair:
+            self.sem = FairLimiter(pool_size, loop=loop)
+        elif pool_size is not None and prioritized:
+            self.sem = PriorityLimiter(pool_size, aging, loop=loop)
+        elif pool_size is not None:
+            self.sem = asyncio.Semaphore(pool_size, loop=loop)
+        elif key_size or key_sizes or rate or key_rate:
+            self.sem = None
+        else:
+            raise ValueError('pool_size is required unless adaptive')
+        if key_size or key_sizes:
+            self.keyed = KeyedLimiter(key_size, key_sizes, loop=loop)
+        else:
+            self.keyed = None
+        self.bucket = TokenBucket(rate, burst, loop=loop) if rate else None
+        if key_rate:
+            self.key_bucket = KeyedTokenBucket(key_rate, key_burst, loop=loop)
+        else:
+            self.key_bucket = None
+        self.pool_size = pool_size
+        self.latencies = Latencies()
+        self.flights = SingleFlight(
+            ResultCache(cache_size, cache_ttl) if cache_size else None)
+        super(Pool, self).__init__(loop, runner, executor, stats)
+
+    @property
+    def size(self):
+        """ The current concurrency limit """
+        if isinstance(self.sem, AdaptiveLimiter):
+            return int(self.sem.limit)
+        return self.pool_size
+
+    def spawn(self, coro, key=None, timeout=None, retries=0, backoff=0.1,
+              hedge_after=None, cache_key=None, priority=None):
+        if self.runner is not None and not self.runner.in_loop():
+            return self.runner.call(self.spawn, coro, key, timeout, retries,
+                                    backoff, hedge_after, cache_key, priority)
+        if priority is not None and not isinstance(self.sem, PriorityLimiter):
+            raise ValueError('priority needs Pool(prioritized=True)')
+
+        if cache_key is not None:
+            hit, result = self.flights.cached(cache_key)
+            if hit:
+                close_coro(coro)
+                future = asyncio.Future(loop=self.loop)
+                future.set_result(result)
+                return future
+            flight = self.flights.get(cache_key)
+            if flight is not None:
+                close_coro(coro)
+                return self._spawn_task(
+                    self.flights.follow(flight, loop=self.loop))
+            task = self.spawn(coro, key, timeout, retries, backoff,
+                              hedge_after, priority=priority)
+            self.flights.lead(cache_key, task)
+            return task
+
+        if timeout is not None or retries or hedge_after is not None:
+            policy = RetryPolicy(timeout, retries, backoff, hedge_after)
+        else:
+            policy = None
+            assert asyncio.iscoroutine(coro) or callable(coro), \
+                'pool only accepts coroutine'
+        return self._spawn_task(self._gated(coro, key, policy, priority))
 
     async = spawn
+
+    def spawn_many(self, coros, workers=None):
+        """ Run coroutines from the iterable coros with `workers` workers
+
+        Instead of a task (and its callbacks) per coroutine, `workers` long
+        lived tasks (pool_size by default) pull the next coroutine when
+        they have a slot, and run it themselves, so coros may be a lazy
+        generator of millions. `join` waits for all of them. There is no
+        key, retry or cache per coroutine, and as with tasks nobody awaits,
+        exceptions go to the loop exception handler.
+        """
+        if self.runner is not None and not self.runner.in_loop():
+            self.runner.call(self.spawn_many, coros, workers)
+            return
+        workers = workers or self.pool_size
+        if not workers:
+            raise ValueError('spawn_many needs a pool_size or workers')
+        sem = self._worker_sem(workers)
+        items = iter(coros)
+        for _ in range(workers):
+            self._spawn_task(self._work(items, sem))
+
+    def spawn_map(self, func, *iterables, workers=None):
+        """ spawn_many of func(*args) for args from iterables """
+        self.spawn_many((func(*args) for args in zip(*iterables)), workers)
+
+    @asyncio.coroutine
+    def _work(self, items, sem):
+        while True:
+            yield from self._wait_rate()
+            with (yield from sem):
+                coro = next(items, None)
+                if coro is None:
+                    return
+                try:
+                    yield from self._gate_pulled(coro)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.loop.call_exception_handler({
+                        'message': 'Exception in a coroutine of spawn_many',
+                        'exception': e,
+                    })
+
+    def group(self, name, weight=1, **kwargs):
+        """ A ChildGroup drawing slots from this pool
+
+        Under contention, slots are shared among the groups (and the tasks
+        spawned into the pool itself, weight 1) by their weights, the rate
+        and per key limits of the pool hold for all of them. kwargs are
+        passed to the ChildGroup (a Yielder).
+        """
+        if not isinstance(self.sem, FairLimiter):
+            raise ValueError('group needs Pool(fair=True)')
+        kwargs.setdefault('stats', self.metrics)
+        # per key limits hold across the groups, like the slots and rate
+        kwargs.setdefault('key_size', self.keyed)
+        kwargs.setdefault('key_rate', self.key_bucket)
+        return ChildGroup(self.sem.flow(name, weight), loop=self.loop,
+                          runner=self.runner, rate=self.bucket, **kwargs)
+
+    def imap(self, func, *iterables):
+        """ Yield results of func(*args) in the order of inputs
+
+        Inputs are only pulled when the pool has free slots.
+        """
+        y = OrderedYielder(self.sem, loop=self.loop, runner=self.runner,
+                           rate=self.bucket, stats=self.metrics)
+        return y.map(func, *iterables)
+
+    def imap_unordered(self, func, *iterables):
+        """ Like imap, but yield results as soon as they are ready """
+        y = Yielder(self.sem, loop=self.loop, runner=self.runner,
+                    rate=self.bucket, stats=self.metrics)
+        return y.map(func, *iterables)
+
+
+class ChildGroup(Yielder):
+
+    """ A job sharing the slots of a fair Pool, see Pool.group
+
+    Spawn into it and either `join` it or consume its results with
+    `yielding` like any Yielder, results are kept until then.
+    """
+
+    def join(self):
+        """ Wait for everything spawned, dropping the results """
+        if self.native:
+            return _Join(self._join_native(), self.loop)
+        for _ in self.yielding_batches():
+            pass
+
+    @asyncio.coroutine
+    def _join_native(self):
+        while True:
+            try:
+                yield from self.__anext__()
+            except StopAsyncIteration:
+                return
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Timeouts, retries and hedged requests for spawned work
+
+Used by `spawn(..., timeout=, retries=, backoff=, hedge_after=)` of Pool and
+Yielder. Every attempt goes through the pool gates (slots, rate limits) on
+its own, so a task sleeping through its backoff holds no slot, and a hedged
+duplicate takes a slot of its own.
+"""
+import asyncio
+import collections
+
+
+class Latencies(object):
+
+    """ Latencies of the last `size` successful attempts """
+
+    def __init__(self, size=1000, min_samples=20):
+        self.samples = collections.deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, latency):
+        self.samples.append(latency)
+
+    def percentile(self, p):
+        """ The p-th percentile, None until there are enough samples """
+        n = len(self.samples)
+        if n < self.min_samples:
+            return None
+        return sorted(self.samples)[min(n - 1, int(n * p / 100))]
+
+
+class RetryPolicy(object):
+
+    """ How to run one spawned task
+
+    - `timeout`: seconds for each attempt, raises asyncio.TimeoutError
+    - `retries`: attempts after the first one, on any exception
+    - `backoff`: sleep `backoff * 2 ** n` seconds before the n-th retry
+    - `hedge_after`: start a duplicate attempt when the first one runs for
+      that many seconds, or, given as 'p95' and the like, longer than that
+      percentile of the recent latencies. The first to succeed wins, the
+      other is cancelled.
+    """
+
+    def __init__(self, timeout=None, retries=0, backoff=0.1,
+                 hedge_after=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        if isinstance(hedge_after, str):
+            if not hedge_after.startswith('p'):
+                raise ValueError('hedge_after must be seconds or like "p95"')
+            self.hedge_percentile = float(hedge_after[1:])
+            self.hedge_after = None
+        else:
+            self.hedge_percentile = None
+            self.hedge_after = hedge_after
+
+    @property
+    def hedged(self):
+        return self.hedge_after is not None or \
+            self.hedge_percentile is not None
+
+    def wrap(self, coro, gate, latencies, loop):
+        """ Coroutine running coro under the policy
+
+        coro is a coroutine function (called once per attempt), or a
+        coroutine if there is nothing to retry or hedge. gate(coro) wraps
+        an attempt in the pool gates.
+        """
+        if asyncio.iscoroutine(coro):
+            if self.retries or self.hedged:
+                raise ValueError('retries and hedge_after need a coroutine '
+                                 'function, not a coroutine')
+            factory = lambda: coro
+        else:
+            factory = coro
+        return self._run(factory, gate, latencies, loop)
+
+    @asyncio.coroutine
+    def _run(self, factory, gate, latencies, loop):
+        attempt = 0
+        while True:
+            try:
+                if self.hedged:
+                    return (yield from self._hedged(factory, gate, latencies,
+                                                    loop))
+                return (yield from gate(self._attempt(factory, latencies,
+                                                      loop)))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if attempt >= self.retries:
+                    raise
+            # out of the gates, backing off holds no slot
+            yield from asyncio.sleep(self.backoff * 2 ** attempt, loop=loop)
+            attempt += 1
+
+    @asyncio.coroutine
+    def _attempt(self, factory, latencies, loop, started=None):
+        # only runs once the gates let it in
+        if started is not None and not started.done():
+            started.set_result(None)
+        start = loop.time()
+        coro = factory()
+        if self.timeout is not None:
+            coro = asyncio.wait_for(coro, self.timeout, loop=loop)
+        result = yield from coro
+        latencies.add(loop.time() - start)
+        return result
+
+    def _hedge_delay(self, latencies):
+        if self.hedge_percentile is not None:
+            return latencies.percentile(self.hedge_percentile)
+        return self.hedge_after
+
+    @asyncio.coroutine
+    def _hedged(self, factory, gate, latencies, loop):
+        started = asyncio.Future(loop=loop)
+        first = asyncio.async(
+            gate(self._attempt(factory, latencies, loop, started)), loop=loop)
+        attempts = [first]
+        try:
+            # the clock starts when the first attempt is let in
+            yield from asyncio.wait([first, started], loop=loop,
+                                    return_when=asyncio.FIRST_COMPLETED)
+            delay = self._hedge_delay(latencies)
+            if delay is not None and not first.done():
+                yield from asyncio.wait([first], timeout=delay, loop=loop)
+                if not first.done():
+                    attempts.append(asyncio.async(
+                        gate(self._attempt(factory, latencies, loop)),
+                        loop=loop))
+            while True:
+                done, pending = yield from asyncio.wait(
+                    attempts, loop=loop, return_when=asyncio.FIRST_COMPLETED)
+                for f in done:
+                    if f.exception() is None:
+                        return f.result()
+                if not pending:
+                    return done.pop().result()
+                # one failed, the other may still succeed
+                attempts = list(pending)
+        finally:
+            for f in attempts:
+                f.cancel()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" LoopRunner: one long-lived event loop in a background thread
+
+Group, Pool and Yielder normally run (and stop) the event loop of the
+calling thread on every join/yielding, pass a runner instead to submit the
+work to a loop that never stops, and just block on a concurrent future.
+
+Usage::
+
+>>> runner = LoopRunner()
+>>> g = Group(runner=runner)
+>>> for url in urls:
+...     g.spawn(f(url))
+>>> g.join()
+>>> runner.stop()
+"""
+import asyncio
+import functools
+import threading
+import collections
+import concurrent.futures
+
+
+class LoopRunner(object):
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run,
+                                       name='aioutils-loop-runner')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def in_loop(self):
+        """ Whether we are in the loop thread """
+        return threading.get_ident() == self.thread.ident
+
+    def call(self, fn, *args):
+        """ Call fn(*args) in the loop thread, return a concurrent Future
+
+        If fn returns an asyncio future (e.g. a Task), the concurrent Future
+        follows it.
+        """
+        future = concurrent.futures.Future()
+
+        def _call():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                result = fn(*args)
+            except Exception as e:
+                future.set_exception(e)
+                return
+            if isinstance(result, asyncio.Future):
+                result.add_done_callback(
+                    functools.partial(_copy_state, future))
+            else:
+                future.set_result(result)
+
+        self.loop.call_soon_threadsafe(_call)
+        return future
+
+    def run(self, fn, *args):
+        """ Call fn(*args) in the loop thread and wait for the result """
+        if self.in_loop():
+            return fn(*args)
+        return self.call(fn, *args).result()
+
+    def submit(self, coro):
+        """ Schedule coro in the loop, return a concurrent Future """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class Inbox(object):
+
+    """ Calls handed to a loop from any thread, run in batches
+
+    Producers append to a deque, only the first one since the last flush
+    wakes the loop up with call_soon_threadsafe, the loop then runs all
+    the calls queued so far. No lock: deque appends and pops are atomic,
+    and a racing producer costs at most one extra wakeup. `on_flushed` is
+    called after each flush.
+    """
+
+    def __init__(self, loop, on_flushed=None):
+        self.loop = loop
+        self.on_flushed = on_flushed
+        self.calls = collections.deque()
+        self.scheduled = False
+
+    def __len__(self):
+        return len(self.calls)
+
+    def submit(self, fn, *args, **kwargs):
+        self.calls.append((fn, args, kwargs))
+        if not self.scheduled:
+            self.scheduled = True
+            self.loop.call_soon_threadsafe(self.flush)
+
+    def flush(self):
+        # calls submitted from now on schedule another flush, leave them to
+        # it so that busy producers can't hold the loop here
+        self.scheduled = False
+        calls = self.calls
+        for _ in range(len(calls)):
+            fn, args, kwargs = calls.popleft()
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                self.loop.call_exception_handler({
+                    'message': 'Exception in a threadsafe call',
+                    'exception': e,
+                })
+        if self.on_flushed is not None:
+            self.on_flushed()
+
+
+def _copy_state(future, f):
+    if f.cancelled():
+        future.set_exception(concurrent.futures.CancelledError())
+    elif f.exception() is not None:
+        future.set_exception(f.exception())
+    else:
+        future.set_result(f.result())
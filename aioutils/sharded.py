@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" ShardedPool and ShardedYielder: use all cores
+
+Everything else in aioutils runs on one event loop in one thread, CPU heavy
+coroutines (parsing, hashing, ...) saturate one core. A ShardedPool starts
+N worker processes, each running its own event loop with its own pool, and
+spreads the spawned work across them.
+
+Work is an importable coroutine function plus picklable args, results (and
+exceptions) are pickled back over pipes.
+
+Usage::
+
+>>> @asyncio.coroutine
+>>> def parse(url):
+...     ...
+
+>>> y = ShardedYielder(processes=4, pool_size=100)
+>>> for url in urls:
+...     y.spawn(parse, url)
+>>> for result in y.yielding():
+...     print(result)
+>>> y.close()
+"""
+import os
+import queue
+import heapq
+import pickle
+import asyncio
+import threading
+import multiprocessing
+import multiprocessing.connection
+
+
+class ShardedPool(object):
+
+    """ Spawn coroutine functions into N worker processes and join them
+
+    `pool_size` limits the concurrency inside each worker, spawned work is
+    sent to the worker with the least outstanding work, in chunks of
+    `chunksize` (pending chunks are flushed on join/yielding).
+    """
+
+    def __init__(self, processes=None, pool_size=None, chunksize=64):
+        self.processes = processes or os.cpu_count() or 1
+        self.pool_size = pool_size
+        self.chunksize = chunksize
+        self.workers = []
+        # bumped when pending work is given up, late results are dropped
+        self.epoch = 0
+        self._prepare()
+
+    def _prepare(self):
+        self.order = 0
+        self.counter = 0
+        self.exceptions = []
+        self.outstanding = [0] * self.processes
+        self.chunks = [[] for _ in range(self.processes)]
+
+    def _start(self):
+        for _ in range(self.processes):
+            task_r, task_w = multiprocessing.Pipe(duplex=False)
+            result_r, result_w = multiprocessing.Pipe(duplex=False)
+            p = multiprocessing.Process(target=_worker,
+                                        args=(task_r, result_w,
+                                              self.pool_size))
+            p.daemon = True
+            p.start()
+            task_r.close()
+            result_w.close()
+            self.workers.append((p, task_w, result_r))
+
+    def spawn(self, func, *args):
+        """ Run func(*args) in one of the workers
+
+        func must be an importable coroutine function, args picklable.
+        """
+        if not self.workers:
+            self._start()
+        outstanding = self.outstanding
+        shard = outstanding.index(min(outstanding))
+        self.order += 1
+        self.counter += 1
+        outstanding[shard] += 1
+        chunk = self.chunks[shard]
+        chunk.append((self.order, func, args))
+        if len(chunk) >= self.chunksize:
+            self._flush(shard)
+
+    def _flush(self, shard):
+        chunk = self.chunks[shard]
+        if chunk:
+            self.chunks[shard] = []
+            self.workers[shard][1].send(('spawn', self.epoch, chunk))
+
+    def _recv(self):
+        """ Block until some results arrive, return them """
+        for shard in range(self.processes):
+            self._flush(shard)
+        conns = [w[2] for w in self.workers]
+        results = []
+        for conn in multiprocessing.connection.wait(conns):
+            shard = conns.index(conn)
+            for epoch, order, exc, result in conn.recv():
+                if epoch != self.epoch:
+                    continue
+                self.counter -= 1
+                self.outstanding[shard] -= 1
+                if exc is not None:
+                    self.exceptions.append(exc)
+                    result = None
+                results.append((order, result))
+        return results
+
+    def join(self):
+        try:
+            while self.counter > 0:
+                self._recv()
+            if self.exceptions:
+                raise self.exceptions[0]
+        finally:
+            self._prepare()
+
+    def _cancel_pending(self):
+        self.epoch += 1
+        for p, task_w, result_r in self.workers:
+            task_w.send(('cancel', self.epoch))
+
+    def close(self):
+        """ Stop all the worker processes """
+        for p, task_w, result_r in self.workers:
+            task_w.send(None)
+        for p, task_w, result_r in self.workers:
+            p.join()
+            task_w.close()
+            result_r.close()
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ShardedYielder(ShardedPool):
+
+    """ A ShardedPool that yields the results, like Yielder
+
+    With `ordered`, results are yielded in spawning order like
+    OrderedYielder.
+    """
+
+    def __init__(self, processes=None, pool_size=None, chunksize=64,
+                 ordered=False):
+        self.ordered = ordered
+        super(ShardedYielder, self).__init__(processes, pool_size, chunksize)
+
+    def _yielding(self, heappush=heapq.heappush, heappop=heapq.heappop):
+        done = []
+        yield_counter = 1
+        while self.counter > 0:
+            results = self._recv()
+            if not self.ordered:
+                for _, result in results:
+                    if result is not None:
+                        yield result
+                continue
+
+            for item in results:
+                heappush(done, item)
+            while done and done[0][0] == yield_counter:
+                _, result = heappop(done)
+                yield_counter += 1
+                if result is not None:
+                    yield result
+
+    def yielding(self):
+        try:
+            yield from self._yielding()
+        except GeneratorExit:
+            self._cancel_pending()
+
+        exceptions = self.exceptions
+        self._prepare()
+        if exceptions:
+            raise exceptions[0]
+
+
+def _worker(task_r, result_w, pool_size):
+    """ Worker process: run spawned coroutines in a fresh loop """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    sem = asyncio.Semaphore(pool_size, loop=loop) if pool_size else None
+    outbox = queue.Queue()
+    tasks = {}
+    state = {'epoch': 0, 'stopping': False}
+
+    @asyncio.coroutine
+    def _run(func, args):
+        if sem:
+            with (yield from sem):
+                return (yield from func(*args))
+        return (yield from func(*args))
+
+    def _on_done(key, f):
+        del tasks[key]
+        epoch, order = key
+        # always answer, or the parent waits for it forever, results of a
+        # cancelled epoch are dropped there
+        if f.cancelled():
+            outbox.put((epoch, order, None, None))
+        else:
+            outbox.put((epoch, order, f.exception(),
+                        None if f.exception() else f.result()))
+        if state['stopping'] and not tasks:
+            loop.stop()
+
+    def _on_message(msg):
+        if msg is None:
+            state['stopping'] = True
+            if not tasks:
+                loop.stop()
+        elif msg[0] == 'spawn':
+            _, epoch, chunk = msg
+            if epoch != state['epoch']:
+                return
+            for order, func, args in chunk:
+                key = (epoch, order)
+                task = asyncio.async(_run(func, args), loop=loop)
+                tasks[key] = task
+                task.add_done_callback(lambda f, key=key: _on_done(key, f))
+        elif msg[0] == 'cancel':
+            state['epoch'] = msg[1]
+            for task in list(tasks.values()):
+                task.cancel()
+
+    def _read():
+        while True:
+            msg = task_r.recv()
+            loop.call_soon_threadsafe(_on_message, msg)
+            if msg is None:
+                break
+
+    def _send():
+        # send whatever piled up in one message, None (last) means stop
+        stopping = False
+        while not stopping:
+            msgs = [outbox.get()]
+            while True:
+                try:
+                    msgs.append(outbox.get_nowait())
+                except queue.Empty:
+                    break
+            if msgs[-1] is None:
+                msgs.pop()
+                stopping = True
+            if msgs:
+                _send_results(result_w, msgs)
+
+    reader = threading.Thread(target=_read)
+    reader.daemon = True
+    reader.start()
+    sender = threading.Thread(target=_send)
+    sender.start()
+    loop.run_forever()
+    outbox.put(None)
+    sender.join()
+    loop.close()
+
+
+def _send_results(conn, msgs):
+    try:
+        conn.send(msgs)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        conn.send([_picklable(msg) for msg in msgs])
+
+
+def _picklable(msg):
+    epoch, order, exc, result = msg
+    try:
+        pickle.dumps(msg)
+    except Exception as e:
+        return (epoch, order, RuntimeError(repr(exc or e)), None)
+    return msg
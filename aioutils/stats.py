@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Opt-in metrics for Group, Pool and Yielder
+
+Created with `stats=True` (or a shared Stats instance), a pool records how
+long its tasks wait for a slot and how long they run, counts spawned,
+finished, failed and cancelled tasks, and samples event loop lag. Snapshots
+come from `pool.stats()`, hooks let you export to Prometheus and the like::
+
+>>> stats = Stats(on_done=lambda run, exc: histogram.observe(run))
+>>> p = Pool(100, stats=stats)
+>>> ...
+>>> p.stats()
+{'spawned': 1000, 'wait': {'count': 1000, 'p50': 0.0032, ...}, ...}
+
+Histograms have fixed exponential buckets, recording is a bisect and two
+additions, cheap enough to keep on in production.
+"""
+import time
+import bisect
+import asyncio
+import weakref
+
+# loop -> {lag_interval: _LagSampler}
+_samplers = weakref.WeakKeyDictionary()
+
+
+class Histogram(object):
+
+    """ Fixed buckets from 100us doubling up to about 100s (seconds) """
+
+    bounds = [0.0001 * 2 ** i for i in range(21)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """ Upper bound of the bucket holding the p-th percentile """
+        if not self.count:
+            return None
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+
+class Stats(object):
+
+    """ Counters and histograms of a pool, with hooks
+
+    - `on_spawn()`: a task is spawned
+    - `on_start(wait)`: it got its slot after `wait` seconds
+    - `on_done(run, exc)`: it ran for `run` seconds, exc is None on success
+
+    The loop lag (how late a timer fires) is sampled every `lag_interval`
+    seconds, only for loops that keep running (a LoopRunner, or inside a
+    running loop): a loop stopped between joins would look lagging. One
+    timer per loop samples for every Stats, it stops once they are all
+    garbage collected (or closed).
+    """
+
+    def __init__(self, on_spawn=None, on_start=None, on_done=None,
+                 lag_interval=1.0):
+        self.on_spawn = on_spawn
+        self.on_start = on_start
+        self.on_done = on_done
+        self.lag_interval = lag_interval
+        self.spawned = 0
+        self.started = 0
+        self.finished = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.wait = Histogram()
+        self.run = Histogram()
+        self.lag = Histogram()
+        self.samplers = set()
+
+    def track(self, coro):
+        """ Count coro as spawned now, wrap it innermost (inside the gates)
+        so that it starts once it has its slot
+        """
+        self.spawned += 1
+        if self.on_spawn is not None:
+            self.on_spawn()
+        return self._tracked(coro, time.monotonic())
+
+    @asyncio.coroutine
+    def _tracked(self, coro, spawned):
+        start = time.monotonic()
+        wait = start - spawned
+        self.started += 1
+        self.wait.add(wait)
+        if self.on_start is not None:
+            self.on_start(wait)
+        try:
+            result = yield from coro
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        except Exception as e:
+            self.failed += 1
+            self._done(time.monotonic() - start, e)
+            raise
+        self.finished += 1
+        self._done(time.monotonic() - start, None)
+        return result
+
+    def _done(self, run, exc):
+        self.run.add(run)
+        if self.on_done is not None:
+            self.on_done(run, exc)
+
+    def watch(self, loop):
+        """ Sample the lag of loop, which must keep running """
+        if not self.lag_interval:
+            return
+        samplers = _samplers.setdefault(loop, {})
+        sampler = samplers.get(self.lag_interval)
+        if sampler is None:
+            sampler = samplers[self.lag_interval] = _LagSampler(
+                loop, self.lag_interval)
+        sampler.add(self)
+        self.samplers.add(sampler)
+
+    def close(self):
+        """ Stop sampling loop lag for this Stats """
+        for sampler in self.samplers:
+            sampler.watchers.discard(self)
+        self.samplers = set()
+
+    def snapshot(self, **gauges):
+        """ A dict of everything, gauges (e.g. in_flight) are added as is """
+        snapshot = {
+            'spawned': self.spawned,
+            'started': self.started,
+            'finished': self.finished,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+            'wait': self.wait.snapshot(),
+            'run': self.run.snapshot(),
+            'loop_lag': self.lag.snapshot(),
+        }
+        snapshot.update(gauges)
+        return snapshot
+
+
+class _LagSampler(object):
+
+    """ A timer of a loop, adding its lag to the Stats watching it
+
+    Stats and the loop are only weakly referenced (a strong one would keep
+    the loop key of _samplers alive), the timer stops when no Stats is
+    left.
+    """
+
+    def __init__(self, loop, interval):
+        self.loop = weakref.ref(loop)
+        self.interval = interval
+        self.watchers = weakref.WeakSet()
+        self.armed = False
+
+    def add(self, stats):
+        self.watchers.add(stats)
+        if not self.armed:
+            self.armed = True
+            self._schedule(self.loop())
+
+    def _schedule(self, loop):
+        expected = loop.time() + self.interval
+        loop.call_at(expected, self._on_tick, expected)
+
+    def _on_tick(self, expected):
+        loop = self.loop()
+        lag = max(0.0, loop.time() - expected)
+        watchers = list(self.watchers)
+        if not watchers:
+            self.armed = False
+            samplers = _samplers.get(loop, {})
+            if samplers.get(self.interval) is self:
+                del samplers[self.interval]
+                if not samplers:
+                    del _samplers[loop]
+            return
+        for stats in watchers:
+            stats.lag.add(lag)
+        self._schedule(loop)
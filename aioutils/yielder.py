@@ -6,8 +6,17 @@ import asyncio
 import functools
 import collections
 
+from .gate import Gated
+from .limiter import KeyedLimiter, TokenBucket, KeyedTokenBucket
+from .limiter import PriorityLimiter
+from .retry import Latencies, RetryPolicy
+from .cache import ResultCache, SingleFlight, close_coro
+from .executor import run_blocking
+from .stats import Stats
+from .runner import Inbox
 
-class Yielder(object):
+
+class Yielder(Gated):
 
     """ A Bag Rewrite
 
@@ -15,178 +24,1019 @@ class Yielder(object):
     - no background threading
 
     Each time when an item is put, we stop the main loop(!!) and yield
+
+    Stopping and restarting the loop for every item is costly when there are
+    lots of small results, use `max_batch` and/or `linger` to keep the loop
+    running until `max_batch` items are ready or `linger` seconds passed since
+    the first ready item, then hand the whole batch to the sync side.
+
+    With `max_buffered`, no new task starts while buffered results plus
+    running tasks reach `max_buffered`, so producers run only as fast as the
+    consumer drains. Coroutines may `yield from y.aput(item)` to wait for
+    room too, while `put` never blocks.
+
+    Pass a `LoopRunner` as `runner` to keep the loop running in its own
+    thread, the consumer then blocks on a concurrent future for each batch
+    instead of starting and stopping the loop.
+
+    Blocking callables can be spawned with `spawn_blocking`, they run in
+    `executor` (a thread or process pool, None for the loop default).
+
+    Tasks spawned with a `key` (e.g. the host of an url) are also limited
+    to `key_size` (or `key_sizes[key]`) concurrent tasks per key, under the
+    overall `pool_size`.
+
+    `rate` limits task starts to `rate` per second (bursts of `burst`), and
+    `key_rate` per key, with token buckets.
+
+    Created inside a running loop, results are consumed with `async for`
+    instead, `async with` cancels what is left when leaving early.
+
+    `on_error` decides what a failed task does:
+
+    - 'collect' (default): keep going, raise the first exception once all
+      tasks are done, keeping at most `max_exceptions` of them
+    - 'fail_fast': cancel everything left and raise at once
+    - 'yield': yield the exception object in place of the result
+
+    `spawn` takes `timeout`, `retries`, `backoff` and `hedge_after` too, see
+    RetryPolicy, pass a coroutine function instead of a coroutine to retry
+    or hedge it.
+
+    Tasks spawned with the same `cache_key` while one of them runs share its
+    result, and with `cache_size`, results are cached for `cache_ttl`
+    seconds (forever if None) across runs, a cached result is yielded
+    without scheduling a task.
+
+    With `prioritized`, slots of `pool_size` go to `spawn(coro, priority=n)`
+    by priority (lower first) instead of FIFO, waiting tasks gain `aging`
+    priority per second, see PriorityLimiter.
+
+    Async generators are spawned with `spawn_stream` (or just `spawn`),
+    every item they produce is yielded right away, and they hold their
+    slot until exhausted.
+
+    With `stats=True` (or a Stats instance), task waits, run times and loop
+    lag are recorded, `stats()` returns a snapshot with the results
+    buffered.
+
+    Producer threads feed a yielder being consumed with `spawn_threadsafe`
+    and `put_threadsafe`, the loop is woken up once per batch of them.
     """
 
-    def __init__(self, pool_size=None):
-        try:
-            self.loop = asyncio.get_event_loop()
-            if self.loop.is_running():
-                raise NotImplementedError("Cannot use aioutils in "
-                                          "asynchroneous environment")
-        except:
-            self.loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(self.loop)
-        self.sem = asyncio.Semaphore(pool_size) if pool_size else None
+    def __init__(self, pool_size=None, max_batch=None, linger=None,
+                 max_buffered=None, loop=None, runner=None, executor=None,
+                 key_size=None, key_sizes=None, rate=None, burst=None,
+                 key_rate=None, key_burst=None, on_error='collect',
+                 max_exceptions=None, cache_size=None, cache_ttl=None,
+                 prioritized=False, aging=0, stats=None):
+        if on_error not in ('collect', 'fail_fast', 'yield'):
+            raise ValueError('unknown on_error {!r}'.format(on_error))
+        self.on_error = on_error
+        self.max_exceptions = max_exceptions
+        self.runner = runner
+        self.executor = executor
+        if runner is not None:
+            self.loop = runner.loop
+        else:
+            try:
+                self.loop = loop or asyncio.get_event_loop()
+            except:
+                self.loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self.loop)
+        # created inside a running loop: awaited there, not run
+        self.native = runner is None and self.loop.is_running()
+        self.metrics = Stats() if stats is True else (stats or None)
+        if self.metrics is not None and self.native:
+            self.metrics.watch(self.loop)
+        elif self.metrics is not None and runner is not None:
+            self.loop.call_soon_threadsafe(self.metrics.watch, self.loop)
+        if isinstance(pool_size, int) and not pool_size:
+            # Yielder(0) means no limit
+            pool_size = None
+        if isinstance(pool_size, int) and prioritized:
+            self.sem = PriorityLimiter(pool_size, aging, loop=self.loop)
+        elif isinstance(pool_size, int):
+            self.sem = asyncio.Semaphore(pool_size, loop=self.loop)
+        else:
+            # None, a semaphore shared with others (e.g. a Pool), or a
+            # limiter like AdaptiveLimiter
+            self.sem = pool_size
+        # default number of spawn_many workers
+        self.pool_size = pool_size if isinstance(pool_size, int) else None
+        if isinstance(key_size, KeyedLimiter):
+            # per key limits may be shared with others too (e.g. a Pool)
+            self.keyed = key_size
+        elif key_size or key_sizes:
+            self.keyed = KeyedLimiter(key_size, key_sizes, loop=self.loop)
+        else:
+            self.keyed = None
+        if rate is None or isinstance(rate, TokenBucket):
+            # a bucket may be shared with others (e.g. a Pool)
+            self.bucket = rate
+        else:
+            self.bucket = TokenBucket(rate, burst, loop=self.loop)
+        if isinstance(key_rate, KeyedTokenBucket):
+            self.key_bucket = key_rate
+        elif key_rate:
+            self.key_bucket = KeyedTokenBucket(key_rate, key_burst,
+                                               loop=self.loop)
+        else:
+            self.key_bucket = None
+        if max_batch and max_buffered:
+            # a batch larger than the buffer could never be filled
+            max_batch = min(max_batch, max_buffered)
+        self.max_batch = max_batch
+        self.linger = linger
+        self.max_buffered = max_buffered
+        # tasks cancelled on GeneratorExit, whose callbacks may come later
+        self.abandoned = set()
+        # for hedge_after='p95', kept across runs
+        self.latencies = Latencies()
+        self.flights = SingleFlight(
+            ResultCache(cache_size, cache_ttl) if cache_size else None)
+        # calls from other threads, kept across runs
+        self.inbox = Inbox(self.loop, self._notify)
         self._prepare()
 
     def _prepare(self):
         self.counter = 0
         self.done = collections.deque()
         self.getters = collections.deque()
+        self.putters = collections.deque()
+        self.reserved = 0
+        # tasks holding room for their result, released on completion
+        self.held = set()
         self.exceptions = []
-        self.tasks = []
+        # tasks whose completion is not handled yet, O(in flight)
+        self.tasks = set()
+        self.linger_handle = None
+        # drained but not yet consumed by `async for`
+        self.batch = collections.deque()
+
+    def spawn(self, coro, key=None, timeout=None, retries=0, backoff=0.1,
+              hedge_after=None, cache_key=None, priority=None):
+        if self.runner is not None and not self.runner.in_loop():
+            return self.runner.call(self.spawn, coro, key, timeout, retries,
+                                    backoff, hedge_after, cache_key, priority)
+        if priority is not None and not isinstance(self.sem, PriorityLimiter):
+            raise ValueError('priority needs a prioritized pool_size')
+        if hasattr(coro, '__anext__'):
+            if timeout is not None or retries or hedge_after is not None \
+                    or cache_key is not None:
+                raise ValueError('timeout, retries, hedge_after and '
+                                 'cache_key do not apply to streams')
+            return self.spawn_stream(coro, key, priority)
+        if timeout is not None or retries or hedge_after is not None:
+            policy = RetryPolicy(timeout, retries, backoff, hedge_after)
+        else:
+            policy = None
+        if cache_key is not None:
+            return self._spawn_cached(coro, key, policy, cache_key, priority)
+        return self._spawn(self._async_task(coro, key, policy, priority))
+
+    def _spawn_cached(self, coro, key, policy, cache_key, priority=None):
+        hit, result = self.flights.cached(cache_key)
+        if hit:
+            close_coro(coro)
+            if result is not None:
+                self.put(result)
+            future = asyncio.Future(loop=self.loop)
+            future.set_result(result)
+            return future
+
+        flight = self.flights.get(cache_key)
+        if flight is not None:
+            close_coro(coro)
+            return self._spawn(asyncio.async(
+                self.flights.follow(flight, loop=self.loop), loop=self.loop))
+
+        task = self._spawn(self._async_task(coro, key, policy, priority))
+        self.flights.lead(cache_key, task)
+        return task
+
+    def spawn_blocking(self, fn, *args):
+        """ Spawn fn(*args), running in the executor """
+        return self.spawn(run_blocking(self.loop, self.executor, fn, args))
+
+    def spawn_stream(self, agen, key=None, priority=None):
+        """ Spawn an async generator, yielding its items as they come """
+        if self.runner is not None and not self.runner.in_loop():
+            return self.runner.call(self.spawn_stream, agen, key, priority)
+        if priority is not None and not isinstance(self.sem, PriorityLimiter):
+            raise ValueError('priority needs a prioritized pool_size')
+        coro = self._stream(agen, self._stream_sink())
+        return self._spawn(asyncio.async(
+            self._wrap_stream(coro, key, priority), loop=self.loop))
 
-    def spawn(self, coro):
-        task = self._async_task(coro)
+    def _stream_sink(self):
+        """ Coroutine function taking each item of a stream """
+        return self.aput
+
+    def _wrap_stream(self, coro, key, priority=None):
+        # each item waits for room in aput, the stream itself returns None
+        # and must not hold room on top of that
+        return self._gate(coro, key, priority)
+
+    @asyncio.coroutine
+    def _stream(self, agen, sink):
+        try:
+            while True:
+                try:
+                    item = yield from agen.__anext__()
+                except StopAsyncIteration:
+                    return None
+                if item is not None:
+                    yield from sink(item)
+        finally:
+            # no-op unless we are cancelled while it's suspended
+            if hasattr(agen, 'aclose'):
+                yield from agen.aclose()
+
+    def _spawn(self, task):
         task.add_done_callback(self._on_completion)
         self.counter += 1
-        self.tasks.append(task)
+        self.tasks.add(task)
         return task
 
-    def _async_task(self, coro):
-        if self.sem:
-            @asyncio.coroutine
-            def _limit_coro():
-                with (yield from self.sem):
-                    return (yield from coro)
-            task = asyncio.async(_limit_coro())
+    def _async_task(self, coro, key=None, policy=None, priority=None):
+        return asyncio.async(self._wrap(coro, key, policy, priority),
+                             loop=self.loop)
+
+    def _wrap(self, coro, key=None, policy=None, priority=None):
+        coro = self._gated(coro, key, policy, priority)
+        if self.max_buffered:
+            coro = self._throttle_coro(coro)
+        return coro
+
+    @asyncio.coroutine
+    def _throttle_coro(self, coro):
+        yield from self._wait_room()
+        # released by the completion callback, after the result is in done,
+        # or the room would be given away before the result takes it
+        self.held.add(asyncio.Task.current_task(loop=self.loop))
+        return (yield from coro)
+
+    @asyncio.coroutine
+    def _wait_room(self):
+        """ Reserve room in the buffer, wait for the consumer if it is full
+
+        A running task reserves room for its result until it finishes, so
+        that the buffer never grows beyond `max_buffered`. Waiters are woken
+        in FIFO order and do not check again, so the head of line of an
+        OrderedYielder is never starved.
+        """
+        if self._buffered() + self.reserved >= self.max_buffered \
+                or self.putters:
+            putter = asyncio.Future(loop=self.loop)
+            self.putters.append(putter)
+            try:
+                yield from putter
+            except asyncio.CancelledError:
+                if not putter.cancelled():
+                    self._release_room()
+                raise
         else:
-            task = asyncio.async(coro)
-        return task
+            self.reserved += 1
+
+    def _release_room(self):
+        if asyncio.Task.current_task(loop=self.loop) in self.abandoned:
+            # reserved in a run given up since, _prepare reset the count
+            return
+        self.reserved -= 1
+        if self.putters:
+            self._wake_putters()
+
+    def _buffered(self):
+        """ Number of items taking room in the buffer """
+        return len(self.done)
+
+    def _release_held(self, task):
+        if task in self.held:
+            self.held.discard(task)
+            self._release_room()
+
+    def _wake_putters(self):
+        room = self.max_buffered - self._buffered() - self.reserved
+        while self.putters and room > 0:
+            putter = self.putters.popleft()
+            if not putter.done():
+                putter.set_result(None)
+                self.reserved += 1
+                room -= 1
+
+    def map(self, func, *iterables, limit=None):
+        """ Spawn func(*args) for args from iterables, and yield results
+
+        Inputs are pulled lazily, only when a slot of the pool (or `limit`)
+        frees up, so memory stays O(pool_size) no matter how many inputs.
+
+        A single async iterable (e.g. another Yielder running in the same
+        loop) is pulled asynchronously, func is called with each item.
+        """
+        if limit:
+            sem = asyncio.Semaphore(limit, loop=self.loop)
+        elif self.sem:
+            sem = self.sem
+        else:
+            raise ValueError('map needs a pool_size or a limit')
+
+        if len(iterables) == 1 and hasattr(iterables[0], '__aiter__'):
+            iterator = _AsyncArgs(iterables[0].__aiter__())
+        else:
+            iterator = zip(*iterables)
+        self._call(self._spawn_feeder, self._feed(func, iterator, sem))
+        return self if self.native else self.yielding()
+
+    def _spawn_feeder(self, coro):
+        # returns nothing: through a runner, the caller would wait for it
+        task = asyncio.async(coro, loop=self.loop)
+        task.add_done_callback(self._on_feeder_completion)
+        self.counter += 1
+        self.tasks.add(task)
+
+    @asyncio.coroutine
+    def _feed(self, func, iterator, sem):
+        pull = getattr(iterator, 'pull', None)
+        while True:
+            # take a slot before pulling the next input
+            yield from self._wait_rate()
+            yield from self._admit()
+            slot = yield from sem
+            try:
+                if pull is not None:
+                    args = yield from pull()
+                else:
+                    args = next(iterator, None)
+                if args is None:
+                    self._release_slot(sem)
+                    return
+                coro = func(*args)
+            except:
+                self._release_slot(sem)
+                raise
+            task = self._spawn(asyncio.async(
+                self._release_after(self._gate_pulled(coro), slot),
+                loop=self.loop))
+            if self.max_buffered:
+                # the room reserved by _admit goes with the task
+                self.held.add(task)
+
+    @asyncio.coroutine
+    def _release_after(self, coro, slot):
+        with slot:
+            return (yield from coro)
+
+    def spawn_many(self, coros, workers=None):
+        """ Run coroutines from the iterable coros with `workers` workers
+
+        Instead of a task (and its callbacks) per coroutine, `workers` long
+        lived tasks (pool_size by default) pull the next coroutine when
+        they have a slot, and run it themselves, so coros may be a lazy
+        generator of millions. Results are yielded like spawned ones, in
+        the order they are pulled for an OrderedYielder. There is no key,
+        retry, cache or head_timeout per coroutine.
+        """
+        workers = workers or self.pool_size
+        if not workers:
+            raise ValueError('spawn_many needs an int pool_size or workers')
+        sem = self._worker_sem(workers)
+        items = iter(coros)
+        for _ in range(workers):
+            self._call(self._spawn_feeder, self._work(items, sem))
+
+    def spawn_map(self, func, *iterables, workers=None):
+        """ spawn_many of func(*args) for args from iterables """
+        self.spawn_many((func(*args) for args in zip(*iterables)), workers)
+
+    @asyncio.coroutine
+    def _work(self, items, sem):
+        worker = asyncio.Task.current_task(loop=self.loop)
+        while worker not in self.abandoned:
+            yield from self._wait_rate()
+            yield from self._admit()
+            if self.max_buffered:
+                # the room is held like that of a spawned task, aput of the
+                # coroutine may take it
+                self.held.add(worker)
+            slot = yield from sem
+            try:
+                coro = next(items, None)
+                if coro is None:
+                    sem.release()
+                    self._release_held(worker)
+                    return
+            except:
+                sem.release()
+                self._release_held(worker)
+                raise
+            order = self._next_order()
+            try:
+                result = yield from self._release_after(
+                    self._gate_pulled(coro), slot)
+            except asyncio.CancelledError:
+                self._release_held(worker)
+                raise
+            except Exception as e:
+                result = self._on_error(e)
+            if worker not in self.abandoned:
+                self._put_result(order, result)
+            # after the result is in done
+            self._release_held(worker)
+
+    def _next_order(self):
+        return None
+
+    def _put_result(self, order, result):
+        if result is not None:
+            self._put(result)
+        else:
+            self._notify()
+
+    @asyncio.coroutine
+    def _admit(self):
+        """ Wait until the next input of map may start """
+        if self.max_buffered:
+            yield from self._wait_room()
+
+    def _release_slot(self, sem):
+        sem.release()
+        if self.max_buffered:
+            self._release_room()
+
+    def _on_feeder_completion(self, f):
+        if f in self.abandoned:
+            self.abandoned.discard(f)
+            return
+        self.tasks.discard(f)
+        self.counter -= 1
+        if not f.cancelled() and f.exception() is not None:
+            result = self._on_error(f.exception())
+            if result is not None:
+                return self.put(result)
+        self._notify()
 
     def _on_completion(self, f):
+        if f in self.abandoned:
+            self.abandoned.discard(f)
+            return
+        self.tasks.discard(f)
         self.counter -= 1
         f.remove_done_callback(self._on_completion)
         try:
             result = f.result()
+        except asyncio.CancelledError:
+            result = None
         except Exception as e:
             if not isinstance(e, asyncio.InvalidStateError):
-                self.exceptions.append(e)
-            result = None
+                result = self._on_error(e)
+            else:
+                result = None
         if result is not None:
             self._put(result)
-        if self.counter <= 0 and self.getters:
-            getter = self.getters.popleft()
-            getter.set_result(None)
+        else:
+            self._notify()
+        self._release_held(f)
+
+    def _on_error(self, e):
+        """ Apply on_error to the exception of a task, return what to yield """
+        if self.on_error == 'yield':
+            return e
+        if self.max_exceptions is None or \
+                len(self.exceptions) < self.max_exceptions:
+            self.exceptions.append(e)
+        if self.on_error == 'fail_fast':
+            # buffered results are dropped too, the consumer raises next
+            self._cancel_pending()
+            self.done.clear()
+        return None
 
     def put(self, item):
-        self._put(item)
+        self._call(self._put, item)
+
+    def spawn_threadsafe(self, coro, key=None, **options):
+        """ Spawn from any thread, options are those of spawn """
+        self.inbox.submit(self.spawn, coro, key, **options)
+
+    def put_threadsafe(self, item):
+        """ Put from any thread """
+        self.inbox.submit(self.put, item)
+
+    def _call(self, fn, *args):
+        """ Call fn(*args), in the loop thread if using a runner """
+        if self.runner is None:
+            return fn(*args)
+        return self.runner.run(fn, *args)
+
+    @asyncio.coroutine
+    def aput(self, item):
+        """ Put item, wait for room first if the buffer is full
+
+        A task spawned with `max_buffered` holds room for its result
+        already, its first aput takes that room instead of waiting for more,
+        or running tasks filling the buffer would wait on each other.
+        """
+        if self.max_buffered:
+            task = asyncio.Task.current_task(loop=self.loop)
+            if task in self.held:
+                self.held.discard(task)
+            else:
+                yield from self._wait_room()
+            self.reserved -= 1
+        self.put(item)
 
     def _put(self, item):
+        self.done.append(item)
+        self._notify()
+
+    def _ready(self):
+        """ Number of items that can be handed to the consumer now """
+        return len(self.done)
+
+    def _notify(self):
+        """ Wake up the consumer if a batch is ready (or nothing is left) """
+        if not self.getters:
+            return
+        if self.counter <= 0:
+            # also when only the inbox is left, the consumer checks again
+            self._wakeup()
+            return
+        ready = self._ready()
+        if not ready:
+            return
+        if self.max_batch:
+            if ready >= self.max_batch:
+                self._wakeup()
+                return
+        elif not self.linger:
+            self._wakeup()
+            return
+        if self.linger and self.linger_handle is None:
+            self.linger_handle = self.loop.call_later(self.linger,
+                                                      self._on_linger)
+
+    def _on_linger(self):
+        self.linger_handle = None
         if self.getters:
-            getter = self.getters.popleft()
-            getter.set_result(None)
+            self._wakeup()
 
-        self.done.append(item)
+    def _wakeup(self):
+        if self.linger_handle is not None:
+            self.linger_handle.cancel()
+            self.linger_handle = None
+        getter = self.getters.popleft()
+        getter.set_result(None)
 
     def _stop_loop(self, f):
         self.loop.stop()
 
+    def _drain(self):
+        """ Pop a batch of ready items """
+        done = self.done
+        n = len(done)
+        if self.max_batch and n > self.max_batch:
+            n = self.max_batch
+        return [done.popleft() for _ in range(n)]
+
+    def _on_drained(self):
+        if self.putters:
+            self._wake_putters()
+
+    def _getter(self):
+        getter = asyncio.Future(loop=self.loop)
+        self.getters.append(getter)
+        return getter
+
+    def _wait(self):
+        """ Run the loop until the consumer is woken up """
+        getter = self._getter()
+        getter.add_done_callback(self._stop_loop)
+        if not self.loop.is_running():
+            self.loop.run_forever()
+
+    @asyncio.coroutine
+    def _next_batch(self):
+        """ Wait for the next batch in the loop, empty if nothing left """
+        while True:
+            batch = self._drain()
+            self._on_drained()
+            if batch or (self.counter <= 0 and not self.inbox):
+                return batch
+            yield from self._getter()
+
+    def _yielding_batches(self):
+        if self.runner is not None:
+            while True:
+                batch = self.runner.submit(self._next_batch()).result()
+                if not batch:
+                    break
+                yield batch
+            return
+
+        while self.counter > 0 or self.done or self.inbox:
+            batch = self._drain()
+            self._on_drained()
+            if batch:
+                yield batch
+            elif self.counter > 0 or self.inbox:
+                self._wait()
+
     def _yielding(self):
-        while self.counter > 0 or self.done:
-            if self.done:
-                yield self.done.popleft()
-            else:
-                getter = asyncio.Future()
-                self.getters.append(getter)
-                getter.add_done_callback(self._stop_loop)
-                if not self.loop.is_running():
-                    self.loop.run_forever()
+        for batch in self._yielding_batches():
+            yield from batch
 
-    def yielding(self):
+    def _consume(self, items):
         try:
-            for x in self._yielding():
-                if isinstance(x, asyncio.Future):
-                    continue
-                yield x
+            yield from items
         except GeneratorExit:
-            for task in self.tasks:
-                if not task.done():
-                    task.cancel()
-                    self.counter -= 1
+            self._call(self._cancel_pending)
 
-        if self.exceptions:
-            raise self.exceptions[0]
-        self._prepare()
+        exceptions = self.exceptions
+        self._call(self._prepare)
+        if exceptions:
+            raise exceptions[0]
+
+    def _cancel_pending(self):
+        # done tasks may still have their callback scheduled, ignore them too
+        for task in self.tasks:
+            task.cancel()
+            self.abandoned.add(task)
+            self.counter -= 1
+        self.tasks = set()
+
+    def stats(self):
+        """ A snapshot of the metrics (a dict), None without `stats` """
+        if self.metrics is None:
+            return None
+        return self.metrics.snapshot(
+            in_flight=self.counter, buffered=len(self.done) + len(self.batch))
+
+    def _check_sync(self):
+        if self.native:
+            # the loop is running already, it can't be run from here
+            raise RuntimeError('created inside a running loop, consume it '
+                               'with async for')
+
+    def yielding(self):
+        self._check_sync()
+        return self._consume(
+            x for x in self._yielding() if not isinstance(x, asyncio.Future))
+
+    def yielding_batches(self):
+        """ Like yielding, but yield lists of items
+
+        Handy for consumers doing bulk operations, combine with `max_batch`
+        and `linger` to control the batch size.
+        """
+        self._check_sync()
+        return self._consume(self._yielding_batches())
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        while True:
+            while self.batch:
+                item = self.batch.popleft()
+                if not isinstance(item, asyncio.Future):
+                    return item
+            batch = yield from self._next_batch()
+            if not batch:
+                exceptions = self.exceptions
+                self._prepare()
+                if exceptions:
+                    raise exceptions[0]
+                raise StopAsyncIteration
+            self.batch.extend(batch)
+
+    @asyncio.coroutine
+    def __aenter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __aexit__(self, *args):
+        if self.counter > 0 or self.done:
+            self._cancel_pending()
+            self._prepare()
 
 
 class OrderedYielder(Yielder):
-    def __init__(self, pool_size=None):
-        super(OrderedYielder, self).__init__(pool_size)
-        self._prepare()
+
+    """ A Yielder that yields in spawning order
+
+    One slow task early in the order holds back every later result, use
+    `window` to not start tasks more than `window` positions past the head
+    of line, which bounds the reorder buffer.
+
+    With `head_timeout`, a head of line task that makes the consumer wait
+    longer than `head_timeout` seconds is given up, `placeholder` (if not
+    None) is yielded in its place. `head_policy` decides what happens to
+    the straggler: 'cancel' cancels it, 'skip' lets it run but drops its
+    result.
+    """
+
+    def __init__(self, pool_size=None, window=None, head_timeout=None,
+                 head_policy='cancel', placeholder=None, **kwargs):
+        if head_policy not in ('cancel', 'skip'):
+            raise ValueError('unknown head_policy {!r}'.format(head_policy))
+        self.window = window
+        self.head_timeout = head_timeout
+        self.head_policy = head_policy
+        self.placeholder = placeholder
+        super(OrderedYielder, self).__init__(pool_size, **kwargs)
+        if self.max_batch and window:
+            # only `window` tasks can finish before the consumer drains
+            self.max_batch = min(self.max_batch, window)
 
     def _prepare(self):
         super(OrderedYielder, self)._prepare()
         self.done = []
         self.order = 0
-        self.yield_counter = 0
+        self.yield_counter = 1
+        self.pending = {}
+        self.skipped = set()
+        self.window_waiters = []
+        self.head_timer = None
+        # order -> items streamed by a task not yielded yet
+        self.streams = {}
+        self.streamed = 0
+        # streams past the head of line waiting for room
+        self.stream_waiters = []
+        # task -> its order, items it puts with aput go there too
+        self.orders = {}
 
-    def spawn(self, coro):
+    def _spawn(self, task):
         self.order += 1
-        task = self._async_task(coro)
         task.add_done_callback(
             functools.partial(self._on_completion, order=self.order))
         self.counter += 1
-        self.tasks.append(task)
+        self.tasks.add(task)
+        self.pending[self.order] = task
+        self.orders[task] = self.order
         return task
 
+    def _wrap(self, coro, key=None, policy=None, priority=None):
+        coro = super(OrderedYielder, self)._wrap(coro, key, policy, priority)
+        if self.window:
+            # _spawn gives the task the next order right after
+            coro = self._window_coro(coro, self.order + 1)
+        return coro
+
+    @asyncio.coroutine
+    def _window_coro(self, coro, order):
+        yield from self._wait_window(order)
+        return (yield from coro)
+
+    @asyncio.coroutine
+    def _wait_window(self, order, heappush=heapq.heappush):
+        if order >= self.yield_counter + self.window:
+            waiter = asyncio.Future(loop=self.loop)
+            heappush(self.window_waiters, (order, id(waiter), waiter))
+            yield from waiter
+
+    @asyncio.coroutine
+    def _admit(self):
+        if self.window:
+            yield from self._wait_window(self.order + 1)
+        yield from super(OrderedYielder, self)._admit()
+
+    def _on_drained(self, heappop=heapq.heappop):
+        super(OrderedYielder, self)._on_drained()
+        if self.stream_waiters:
+            # room may be free, or one of them the head of line now
+            self._wake_streams()
+        if self.head_timer and self.head_timer[0] < self.yield_counter:
+            self.head_timer[1].cancel()
+            self.head_timer = None
+        waiters = self.window_waiters
+        if waiters:
+            limit = self.yield_counter + self.window
+            while waiters and waiters[0][0] < limit:
+                _, _, waiter = heappop(waiters)
+                if not waiter.done():
+                    waiter.set_result(None)
+
     def _on_completion(self, f, order):
+        if f in self.abandoned:
+            self.abandoned.discard(f)
+            return
+        self.tasks.discard(f)
         self.counter -= 1
         f.remove_done_callback(self._on_completion)
+        self.pending.pop(order, None)
+        self.orders.pop(f, None)
+        if order in self.skipped:
+            # given up by head_timeout, a placeholder took its place
+            self.skipped.discard(order)
+            self._notify()
+            self._release_held(f)
+            return
         try:
             result = f.result()
+        except asyncio.CancelledError:
+            result = None
         except Exception as e:
             if not isinstance(e, asyncio.InvalidStateError):
-                self.exceptions.append(e)
-            result = None
+                result = self._on_error(e)
+            else:
+                result = None
         self._put((order, result))
+        self._release_held(f)
 
     def _put(self, item, heappush=heapq.heappush):
-        order, item = item
-        if self.yield_counter + 1 == order or self.counter <= 0:
-            if self.getters:
-                getter = self.getters.popleft()
-                getter.set_result(None)
-
-        heappush(self.done, (order, item))
+        heappush(self.done, item)
+        self._notify()
 
     def put(self, item):
+        self._call(self._put_next, item)
+
+    def _put_next(self, item):
         self.order += 1
         self._put((self.order, item))
 
-    def _yielding(self, heappop=heapq.heappop):
-        self.yield_counter = 1
-        while self.counter > 0 or self.done:
-            if self.done:
-                order, item = self.done[0]
-                if self.yield_counter == order:
-                    _, item = heappop(self.done)
-                    if item is not None:
-                        yield item
-                    self.yield_counter += 1
-                    continue
-
-            getter = asyncio.Future()
-            self.getters.append(getter)
-            getter.add_done_callback(self._stop_loop)
-            if not self.loop.is_running():
-                self.loop.run_forever()
+    @asyncio.coroutine
+    def aput(self, item):
+        """ Put item, in the order of the task putting it if any
+
+        Items put by a task are yielded right before its result, like those
+        of a stream, items put after the tasks spawned so far otherwise.
+        Puts of a task past the head of line can't be drained yet, they
+        wait for room, but the head of line never waits.
+        """
+        order = self.orders.get(asyncio.Task.current_task(loop=self.loop))
+        if order is None:
+            yield from super(OrderedYielder, self).aput(item)
+        else:
+            yield from self._put_streamed(order, item)
+
+    def _next_order(self):
+        self.order += 1
+        # the coroutine a spawn_many worker runs next has this order
+        self.orders[asyncio.Task.current_task(loop=self.loop)] = self.order
+        return self.order
+
+    def _put_result(self, order, result):
+        self._put((order, result))
+
+    def _wrap_stream(self, coro, key, priority=None):
+        # items wait in self.streams until the head of line gets there,
+        # room is taken for the whole stream
+        return self._wrap(coro, key, priority=priority)
+
+    def _stream_sink(self):
+        # _spawn gives the task the next order right after
+        return functools.partial(self._put_streamed, self.order + 1)
+
+    @asyncio.coroutine
+    def _put_streamed(self, order, item):
+        # only the head of line can be drained, so it never waits for room,
+        # the others wait until there is room or they are the head
+        while self.max_buffered and order > self.yield_counter and \
+                self._buffered() + self.reserved >= self.max_buffered:
+            waiter = asyncio.Future(loop=self.loop)
+            self.stream_waiters.append(waiter)
+            yield from waiter
+        if order < self.yield_counter:
+            # given up by head_timeout, like its result
+            return
+        stream = self.streams.get(order)
+        if stream is None:
+            stream = self.streams[order] = collections.deque()
+        stream.append(item)
+        self.streamed += 1
+        self._notify()
+
+    def _buffered(self):
+        return len(self.done) + self.streamed
+
+    def _wake_streams(self):
+        waiters, self.stream_waiters = self.stream_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _release_room(self):
+        super(OrderedYielder, self)._release_room()
+        if self.stream_waiters:
+            self._wake_streams()
+
+    def _ready(self):
+        # only count the buffered items once the head of line is done
+        ready = len(self.streams.get(self.yield_counter, ()))
+        if self.done and self.done[0][0] == self.yield_counter:
+            ready += len(self.done)
+        return ready
+
+    def _drain(self, heappop=heapq.heappop):
+        done = self.done
+        streams = self.streams
+        batch = []
+        while True:
+            if self.max_batch and len(batch) >= self.max_batch:
+                break
+            # items streamed by the head of line go first, even if running
+            stream = streams.get(self.yield_counter)
+            if stream:
+                batch.append(stream.popleft())
+                self.streamed -= 1
+                continue
+            if not done:
+                break
+            order = done[0][0]
+            if order != self.yield_counter:
+                # everything is done when counter drops to zero, flush the
+                # rest
+                if self.counter > 0:
+                    break
+                self.yield_counter = order
+                continue
+            _, item = heappop(done)
+            streams.pop(order, None)
+            self.yield_counter = order + 1
+            if item is not None:
+                batch.append(item)
+        return batch
+
+    def _getter(self):
+        if self.head_timeout:
+            self._arm_head_timer()
+        return super(OrderedYielder, self)._getter()
+
+    def _arm_head_timer(self):
+        order = self.yield_counter
+        if self.head_timer is not None:
+            if self.head_timer[0] == order:
+                return
+            self.head_timer[1].cancel()
+        handle = self.loop.call_later(self.head_timeout,
+                                      self._on_head_timeout, order)
+        self.head_timer = (order, handle)
+
+    def _on_head_timeout(self, order):
+        self.head_timer = None
+        if order != self.yield_counter or order not in self.pending:
+            return
+        self.skipped.add(order)
+        if self.head_policy == 'cancel':
+            self.pending[order].cancel()
+        self._put((order, self.placeholder))
+
+
+class _AsyncArgs(object):
+
+    """ Pull args for map from an async iterator, None when exhausted """
+
+    def __init__(self, aiterator):
+        self.aiterator = aiterator
+
+    @asyncio.coroutine
+    def pull(self):
+        try:
+            item = yield from self.aiterator.__anext__()
+        except StopAsyncIteration:
+            return None
+        return (item,)
 
 
 class YieldingContext(object):
-    def __init__(self, pool_size=None, ordered=False):
+    def __init__(self, pool_size=None, ordered=False, **kwargs):
         if ordered:
-            self.y = OrderedYielder(pool_size)
+            self.y = OrderedYielder(pool_size, **kwargs)
         else:
-            self.y = Yielder(pool_size)
+            self.y = Yielder(pool_size, **kwargs)
         self.yielding = None
 
-    def spawn(self, coro):
-        return self.y.spawn(coro)
+    def spawn(self, coro, key=None, **options):
+        return self.y.spawn(coro, key, **options)
+
+    def spawn_blocking(self, fn, *args):
+        return self.y.spawn_blocking(fn, *args)
+
+    def spawn_stream(self, agen, key=None, priority=None):
+        return self.y.spawn_stream(agen, key, priority)
+
+    def spawn_many(self, coros, workers=None):
+        return self.y.spawn_many(coros, workers)
+
+    def spawn_map(self, func, *iterables, workers=None):
+        return self.y.spawn_map(func, *iterables, workers=workers)
 
     def put(self, item):
         return self.y.put(item)
 
+    def spawn_threadsafe(self, coro, key=None, **options):
+        return self.y.spawn_threadsafe(coro, key, **options)
+
+    def put_threadsafe(self, item):
+        return self.y.put_threadsafe(item)
+
+    def aput(self, item):
+        return self.y.aput(item)
+
+    def yielding_batches(self):
+        return self.y.yielding_batches()
+
     def __enter__(self):
         return iter(self)
 
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Overhead benchmarks of Group, Pool, Yielder, OrderedYielder and Bag
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench.py                # all cases
+    PYTHONPATH=. python benchmarks/bench.py -n 10000 pool  # cases matching
+    PYTHONPATH=. python benchmarks/bench.py -o new.json --compare old.json
+
+Coroutines do no work (or sleep 1ms for the scaling cases), so the numbers
+are the cost of the library itself. Every case runs in its own process for
+a clean peak RSS, results are saved as JSON (`bench-<version>.json` by
+default) to compare across versions.
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import resource
+import subprocess
+import tracemalloc
+import collections
+
+import aioutils
+from aioutils import Group, Pool, Yielder, OrderedYielder, Bag, OrderedBag
+
+CASES = collections.OrderedDict()
+
+
+def case(name, **kwargs):
+    def register(func):
+        CASES[name] = (func, kwargs)
+        return func
+    return register
+
+
+@asyncio.coroutine
+def noop():
+    pass
+
+
+@asyncio.coroutine
+def sleep():
+    yield from asyncio.sleep(0.001)
+
+
+@asyncio.coroutine
+def stamp(*args):
+    return time.perf_counter()
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return dict(('p{}'.format(p), values[min(len(values) - 1,
+                                             len(values) * p // 100)])
+                for p in (50, 90, 99))
+
+
+def rate(n, elapsed, unit='tasks'):
+    return {'n': n, 'seconds': elapsed,
+            '{}_per_sec'.format(unit): n / elapsed if elapsed else None}
+
+
+def run_spawns(group, n, coro=noop):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        group.spawn(coro())
+    t1 = time.perf_counter()
+    group.join()
+    t2 = time.perf_counter()
+    result = rate(n, t2 - t0)
+    result['spawn_us'] = (t1 - t0) / n * 1e6
+    return result
+
+
+@case('group')
+def bench_group(n):
+    return run_spawns(Group(), n)
+
+
+for size in (10, 100, 1000):
+    case('pool_{}'.format(size), size=size)(
+        lambda n, size: run_spawns(Pool(size), n))
+    # 1ms tasks: how close to size / 1ms tasks per second
+    case('pool_{}_sleep'.format(size), size=size, scale=0.01)(
+        lambda n, size: run_spawns(Pool(size), n, sleep))
+
+
+@case('pool_spawn_many')
+def bench_pool_spawn_many(n):
+    p = Pool(100)
+    t0 = time.perf_counter()
+    p.spawn_many(noop() for _ in range(n))
+    p.join()
+    return rate(n, time.perf_counter() - t0)
+
+
+def run_yielder(y, n, **spawn):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        y.spawn(stamp(), **spawn)
+    latencies = []
+    for x in y.yielding():
+        latencies.append(time.perf_counter() - x)
+    result = rate(n, time.perf_counter() - t0, 'items')
+    # from the task's return to the consumer
+    result['handoff'] = percentiles(latencies)
+    return result
+
+
+@case('yielder')
+def bench_yielder(n):
+    return run_yielder(Yielder(), n)
+
+
+@case('yielder_batch')
+def bench_yielder_batch(n):
+    return run_yielder(Yielder(max_batch=100), n)
+
+
+@case('yielder_pool')
+def bench_yielder_pool(n):
+    return run_yielder(Yielder(100), n)
+
+
+@case('ordered_yielder')
+def bench_ordered_yielder(n):
+    return run_yielder(OrderedYielder(), n)
+
+
+@case('ordered_yielder_batch')
+def bench_ordered_yielder_batch(n):
+    return run_yielder(OrderedYielder(max_batch=100), n)
+
+
+@case('yielder_spawn_map')
+def bench_yielder_spawn_map(n):
+    y = Yielder(100)
+    y.spawn_map(stamp, range(n))
+    return run_map(y.yielding(), n)
+
+
+@case('ordered_yielder_spawn_map')
+def bench_ordered_yielder_spawn_map(n):
+    y = OrderedYielder(100)
+    y.spawn_map(stamp, range(n))
+    return run_map(y.yielding(), n)
+
+
+def run_map(results, n):
+    t0 = time.perf_counter()
+    latencies = [time.perf_counter() - x for x in results]
+    assert len(latencies) == n
+    result = rate(n, time.perf_counter() - t0, 'items')
+    result['handoff'] = percentiles(latencies)
+    return result
+
+
+@case('imap_unordered')
+def bench_imap_unordered(n):
+    return run_map(Pool(100).imap_unordered(stamp, range(n)), n)
+
+
+@case('imap')
+def bench_imap(n):
+    return run_map(Pool(100).imap(stamp, range(n)), n)
+
+
+def run_bag(b, n):
+    @asyncio.coroutine
+    def put():
+        b.put(time.perf_counter())
+
+    def schedule():
+        for _ in range(n):
+            b.spawn(put())
+        b.join()
+
+    t0 = time.perf_counter()
+    b.schedule(schedule)
+    latencies = [time.perf_counter() - x for x in b.yielder()]
+    result = rate(n, time.perf_counter() - t0, 'items')
+    result['handoff'] = percentiles(latencies)
+    return result
+
+
+@case('bag', scale=0.1)
+def bench_bag(n):
+    return run_bag(Bag(), n)
+
+
+@case('ordered_bag', scale=0.1)
+def bench_ordered_bag(n):
+    return run_bag(OrderedBag(), n)
+
+
+def run_memory(group, n, join=None):
+    """ Bytes allocated per spawned task that has not started yet """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(n):
+        group.spawn(noop())
+    pending = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    (join or group.join)()
+    return {'n': n, 'bytes_per_pending_task': pending / n}
+
+
+@case('memory_group', scale=0.1)
+def bench_memory_group(n):
+    return run_memory(Group(), n)
+
+
+@case('memory_pool', scale=0.1)
+def bench_memory_pool(n):
+    return run_memory(Pool(100), n)
+
+
+@case('memory_yielder', scale=0.1)
+def bench_memory_yielder(n):
+    y = Yielder(100)
+    return run_memory(y, n, lambda: list(y.yielding()))
+
+
+def run_case(name, n):
+    func, kwargs = CASES[name]
+    kwargs = dict(kwargs)
+    n = max(1, int(n * kwargs.pop('scale', 1)))
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    result = func(n, **kwargs)
+    # kilobytes on linux, bytes on mac
+    result['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def run_isolated(name, n):
+    out = subprocess.check_output(
+        [sys.executable, __file__, '--case', name, '-n', str(n)],
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+    return json.loads(out.decode())
+
+
+def throughput(result):
+    for key in ('tasks_per_sec', 'items_per_sec'):
+        if key in result:
+            return result[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('patterns', nargs='*',
+                        help='only run cases matching these regexes')
+    parser.add_argument('-n', type=int, default=100000,
+                        help='tasks per case, scaled down for slow cases')
+    parser.add_argument('-o', '--output',
+                        default='bench-{}.json'.format(aioutils.__version__))
+    parser.add_argument('--compare', help='a previous output to compare to')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.n)))
+        return
+
+    names = [name for name in CASES if not args.patterns or
+             any(re.search(p, name) for p in args.patterns)]
+    base = {}
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)['results']
+
+    results = collections.OrderedDict()
+    for name in names:
+        results[name] = result = run_isolated(name, args.n)
+        line = '{:24} {:>12}'.format(name, '')
+        speed = throughput(result)
+        if speed is not None:
+            line = '{:24} {:12.0f}/s'.format(name, speed)
+            old = base.get(name) and throughput(base[name])
+            if old:
+                line += '  x{:.2f}'.format(speed / old)
+        if 'handoff' in result:
+            line += '  p99 {:.6f}s'.format(result['handoff']['p99'])
+        if 'bytes_per_pending_task' in result:
+            line += '  {:.0f} B/task'.format(
+                result['bytes_per_pending_task'])
+        print(line + '  rss {}'.format(result['peak_rss']))
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'version': aioutils.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'n': args.n,
+            'time': time.time(),
+            'results': results,
+        }, f, indent=2)
+    print('saved to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -18,12 +18,15 @@ setup(
     packages=['aioutils'],
     license='Apache 2.0',
     zip_safe=True,
+    # async comprehensions and generators are new in 3.6, 'async' is a
+    # keyword from 3.7
+    python_requires='>=3.6, <3.7',
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'Intended Audience :: Developers',
         'Natural Language :: English',
         'License :: OSI Approved :: Apache Software License',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4'
+        'Programming Language :: Python :: 3.6',
         ],
     )
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import time
 import random
 import inspect
 import asyncio
@@ -49,6 +50,52 @@ def test_orderedbag():
         assert c1 == c2
 
 
+def test_orderedbag_put_deep_in_stack():
+    b = OrderedBag()
+
+    @asyncio.coroutine
+    def nested(c, depth):
+        if depth:
+            yield from nested(c, depth - 1)
+        else:
+            yield from asyncio.sleep(random.random()*0.01)
+            b.put(c)
+
+    def schedule():
+        for i in range(100):
+            b.spawn(nested(i, 50))
+        b.join()
+
+    b.schedule(schedule)
+    assert list(b.yielder()) == list(range(100))
+    assert b.orders == {}
+
+
+def test_bag_no_polling_latency():
+    for cls in (Bag, OrderedBag):
+        b = cls()
+
+        @asyncio.coroutine
+        def f(c):
+            b.put(c)
+            yield from asyncio.sleep(0.2)
+
+        def schedule():
+            for c in 'ab':
+                b.spawn(f(c))
+            b.join()
+
+        t0 = time.time()
+        b.schedule(schedule)
+        latencies = []
+        for c in b.yielder():
+            latencies.append(time.time() - t0)
+        assert max(latencies) < 0.02
+        assert 0.2 < time.time() - t0 < 0.25
+
+
 if __name__ == '__main__':
     test_bag()
     test_orderedbag()
+    test_orderedbag_put_deep_in_stack()
+    test_bag_no_polling_latency()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+
+from aioutils import Pool, Yielder, OrderedYielder
+from aioutils.cache import ResultCache
+
+
+def counting():
+    calls = []
+
+    @asyncio.coroutine
+    def fetch(url):
+        calls.append(url)
+        yield from asyncio.sleep(0.01)
+        return url.upper()
+    return fetch, calls
+
+
+def test_yielder_coalesces_in_flight():
+    for cls in (Yielder, OrderedYielder):
+        fetch, calls = counting()
+        y = cls(10)
+        for url in 'abab':
+            y.spawn(fetch(url), cache_key=url)
+        results = list(y.yielding())
+        assert sorted(results) == ['A', 'A', 'B', 'B']
+        if cls is OrderedYielder:
+            assert results == ['A', 'B', 'A', 'B']
+        assert calls == ['a', 'b']
+        assert not y.flights.flights
+
+        # no cache, so done flights are fetched again
+        y.spawn(fetch('a'), cache_key='a')
+        assert list(y.yielding()) == ['A']
+        assert len(calls) == 3
+
+
+def test_yielder_cache():
+    fetch, calls = counting()
+    y = OrderedYielder(10, cache_size=2)
+    for url in 'ab':
+        y.spawn(lambda url=url: fetch(url), cache_key=url)
+    assert list(y.yielding()) == ['A', 'B']
+
+    # cached results are yielded in order, without a task
+    y.spawn(lambda: fetch('c'), cache_key='c')
+    future = y.spawn(lambda: fetch('a'), cache_key='a')
+    assert future.done() and future.result() == 'A'
+    y.spawn(lambda: fetch('b'), cache_key='b')
+    assert list(y.yielding()) == ['C', 'A', 'B']
+    assert calls == ['a', 'b', 'c']
+
+
+def test_pool_coalesce_and_cache():
+    fetch, calls = counting()
+    p = Pool(2, cache_size=10, cache_ttl=0.05)
+    tasks = [p.spawn(fetch('a'), cache_key='a') for _ in range(5)]
+    p.join()
+    assert [t.result() for t in tasks] == ['A'] * 5
+    assert calls == ['a']
+
+    assert p.spawn(fetch('a'), cache_key='a').result() == 'A'
+    assert calls == ['a']
+
+    time.sleep(0.06)
+    task = p.spawn(fetch('a'), cache_key='a')
+    p.join()
+    assert task.result() == 'A'
+    assert calls == ['a', 'a']
+
+
+def test_failures_are_not_cached():
+    calls = []
+
+    @asyncio.coroutine
+    def f():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError
+
+    p = Pool(2, cache_size=10)
+    p.spawn(f, cache_key='x')
+    p.join()
+    p.spawn(f, cache_key='x')
+    p.join()
+    assert len(calls) == 2
+
+
+def test_result_cache_lru():
+    cache = ResultCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == (True, 1)
+    cache.set('c', 3)
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1)
+    assert cache.get('c') == (True, 3)
+
+
+if __name__ == '__main__':
+    test_yielder_coalesces_in_flight()
+    test_yielder_cache()
+    test_pool_coalesce_and_cache()
+    test_failures_are_not_cached()
+    test_result_cache_lru()
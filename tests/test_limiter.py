@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+
+from nose.tools import raises
+
+from aioutils import Pool, Yielder, OrderedYielder, AdaptiveLimiter
+from aioutils import PriorityLimiter
+
+
+def test_adaptive_pool_grows():
+    running = []
+    peak = [0]
+
+    @asyncio.coroutine
+    def f():
+        running.append(1)
+        peak[0] = max(peak[0], len(running))
+        yield from asyncio.sleep(0.001)
+        running.pop()
+
+    p = Pool(adaptive=True, min_size=1, max_size=8)
+    assert p.size == 1
+    for _ in range(200):
+        p.spawn(f())
+    p.join()
+    assert p.size == 8
+    assert 1 < peak[0] <= 8
+
+
+def test_adaptive_pool_backs_off():
+    @asyncio.coroutine
+    def f(i):
+        yield from asyncio.sleep(0.001)
+        if i % 2:
+            raise ValueError
+
+    p = Pool(16, adaptive=True, min_size=2, max_size=32)
+    assert p.size == 16
+    for i in range(50):
+        p.spawn(f(i))
+    p.join()
+    assert p.size < 16
+
+
+def test_adaptive_target_latency():
+    @asyncio.coroutine
+    def f(slow):
+        yield from asyncio.sleep(0.02 if slow else 0.001)
+
+    p = Pool(8, adaptive=True, max_size=16, target_latency=0.01)
+    for _ in range(16):
+        p.spawn(f(True))
+    p.join()
+    assert p.size < 8
+
+    size = p.size
+    for _ in range(50):
+        p.spawn(f(False))
+    p.join()
+    assert p.size > size
+
+
+def test_yielder_with_adaptive_limiter():
+    limiter = AdaptiveLimiter(max_size=4)
+
+    @asyncio.coroutine
+    def f(i):
+        assert limiter.active <= 4
+        yield from asyncio.sleep(0.001)
+        return i
+
+    y = Yielder(limiter)
+    assert sorted(y.map(f, range(100))) == list(range(100))
+    assert limiter.limit == 4 and limiter.active == 0
+
+
+def test_keyed_pool():
+    running = {}
+    peak = {}
+
+    @asyncio.coroutine
+    def f(key):
+        running[key] = running.get(key, 0) + 1
+        peak[key] = max(peak.get(key, 0), running[key])
+        assert sum(running.values()) <= 5
+        yield from asyncio.sleep(0.001)
+        running[key] -= 1
+
+    p = Pool(5, key_size=2, key_sizes={'c': 1})
+    for i in range(60):
+        p.spawn(f('abc'[i % 3]), key='abc'[i % 3])
+    p.join()
+    assert peak == {'a': 2, 'b': 2, 'c': 1}
+    assert p.keyed.keys == {}
+
+
+def test_keyed_pool_without_pool_size():
+    running = [0]
+    peak = [0]
+
+    @asyncio.coroutine
+    def f():
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        yield from asyncio.sleep(0.001)
+        running[0] -= 1
+
+    p = Pool(key_size=3)
+    for i in range(30):
+        p.spawn(f(), key=i % 2)
+    # tasks without a key are not limited
+    for i in range(10):
+        p.spawn(f())
+    p.join()
+    assert peak[0] == 16
+
+
+def test_keyed_yielder():
+    running = {}
+
+    @asyncio.coroutine
+    def f(i):
+        key = i % 4
+        running[key] = running.get(key, 0) + 1
+        assert running[key] <= 2
+        yield from asyncio.sleep(0.001)
+        running[key] -= 1
+        return i
+
+    for cls in (Yielder, OrderedYielder):
+        y = cls(6, key_size=2)
+        for i in range(40):
+            y.spawn(f(i), key=i % 4)
+        results = list(y.yielding())
+        assert sorted(results) == list(range(40))
+        if cls is OrderedYielder:
+            assert results == list(range(40))
+        assert y.keyed.keys == {}
+
+
+def test_rate_pool():
+    starts = []
+
+    @asyncio.coroutine
+    def f():
+        starts.append(asyncio.get_event_loop().time())
+        yield from asyncio.sleep(0.001)
+
+    p = Pool(10, rate=200, burst=5)
+    for _ in range(45):
+        p.spawn(f())
+    p.join()
+    # 5 at once, then 40 more at 200/s
+    elapsed = starts[-1] - starts[0]
+    assert 0.18 <= elapsed < 0.3
+    assert starts[4] - starts[0] < 0.005
+
+
+def test_rate_keyed():
+    starts = {}
+
+    @asyncio.coroutine
+    def f(key):
+        starts.setdefault(key, []).append(asyncio.get_event_loop().time())
+        yield from asyncio.sleep(0)
+
+    p = Pool(key_rate=100)
+    for i in range(20):
+        p.spawn(f(i % 2), key=i % 2)
+    p.join()
+    for key in (0, 1):
+        elapsed = starts[key][-1] - starts[key][0]
+        assert 0.085 <= elapsed < 0.15
+
+
+def test_rate_yielder_map():
+    @asyncio.coroutine
+    def f(i):
+        return i
+
+    loop = asyncio.get_event_loop()
+    for cls in (Yielder, OrderedYielder):
+        y = cls(4, rate=500)
+        start = loop.time()
+        results = list(y.map(f, range(50)))
+        assert 0.09 <= loop.time() - start < 0.2
+        assert sorted(results) == list(range(50))
+
+    start = loop.time()
+    results = list(Pool(4, rate=500).imap(f, range(50)))
+    assert 0.09 <= loop.time() - start < 0.2
+    assert results == list(range(50))
+
+
+def test_rate_wait_holds_no_slot():
+    @asyncio.coroutine
+    def f():
+        yield from asyncio.sleep(0.001)
+
+    # waiting for a token is no latency of the slot
+    p = Pool(20, adaptive=True, max_size=40, target_latency=0.05, rate=100)
+    for _ in range(30):
+        p.spawn(f())
+    p.join()
+    assert p.size >= 20
+
+
+def test_priority_pool():
+    started = []
+
+    @asyncio.coroutine
+    def f(name):
+        started.append(name)
+        yield from asyncio.sleep(0.001)
+
+    p = Pool(2, prioritized=True)
+    for i in range(10):
+        p.spawn(f('background'), priority=10)
+    p.spawn(f('urgent'), priority=0)
+    # plain spawns get priority 0 too
+    p.spawn(f('plain'))
+    p.join()
+    # two slots were granted right away, FIFO among equals after that
+    assert started[:4] == ['background', 'background', 'urgent', 'plain']
+    assert p.sem.active == 0 and not p.sem.waiters
+
+
+def test_priority_yielder_aging():
+    @asyncio.coroutine
+    def f(i):
+        yield from asyncio.sleep(0.02)
+        return i
+
+    def spawn_urgent(y):
+        for i in range(10, 13):
+            y.spawn(f(i), priority=0)
+
+    for aging, expected in ((0, [0, 1, 2, 10, 11, 12, 3, 4]),
+                            (2000, [0, 1, 2, 3, 4, 10, 11, 12])):
+        y = Yielder(1, prioritized=True, aging=aging)
+        for i in range(5):
+            y.spawn(f(i), priority=50)
+        # much more urgent, unless the others waited long enough
+        y.loop.call_later(0.05, spawn_urgent, y)
+        assert list(y.yielding()) == expected
+
+
+def test_priority_limiter_cancelled_waiters():
+    loop = asyncio.new_event_loop()
+    limiter = PriorityLimiter(1, loop=loop)
+
+    @asyncio.coroutine
+    def main():
+        yield from limiter.acquire()
+        waiter = asyncio.async(limiter.acquire(5), loop=loop)
+        yield from asyncio.sleep(0, loop=loop)
+        waiter.cancel()
+        yield from asyncio.sleep(0, loop=loop)
+        limiter.release()
+        # only a cancelled waiter is left, the slot must still be free
+        yield from asyncio.wait_for(limiter.acquire(), 0.1, loop=loop)
+        assert limiter.active == 1
+
+    loop.run_until_complete(main())
+    loop.close()
+
+
+@raises(ValueError)
+def test_priority_needs_prioritized():
+    Pool(2).spawn(asyncio.sleep(0), priority=1)
+
+
+if __name__ == '__main__':
+    test_adaptive_pool_grows()
+    test_adaptive_pool_backs_off()
+    test_adaptive_target_latency()
+    test_yielder_with_adaptive_limiter()
+    test_keyed_pool()
+    test_keyed_pool_without_pool_size()
+    test_keyed_yielder()
+    test_rate_pool()
+    test_rate_keyed()
+    test_rate_yielder_map()
+    test_rate_wait_holds_no_slot()
+    test_priority_pool()
+    test_priority_yielder_aging()
+    test_priority_limiter_cancelled_waiters()
+    test_priority_needs_prioritized()
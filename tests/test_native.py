@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import random
+import asyncio
+import threading
+
+from nose.tools import raises
+
+from aioutils import Group, Pool, Yielder, OrderedYielder, Bag
+
+
+@asyncio.coroutine
+def f(c):
+    yield from asyncio.sleep(random.random()*0.02)
+    return c
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(asyncio.new_event_loop())
+
+
+def test_group_native():
+    async def main():
+        loop = asyncio.get_event_loop()
+        g = Group()
+        assert g.native and g.loop is loop
+        results = []
+        for i in range(10):
+            g.spawn(f(i)).add_done_callback(
+                lambda t: results.append(t.result()))
+        await g.join()
+        assert sorted(results) == list(range(10))
+
+        # and again
+        g.spawn(f(10)).add_done_callback(lambda t: results.append(10))
+        await g.join()
+        assert len(results) == 11
+        assert threading.active_count() == 1
+
+    run(main())
+
+
+def test_pool_native_async_with():
+    running = [0]
+
+    async def g(i):
+        running[0] += 1
+        assert running[0] <= 3
+        await asyncio.sleep(0.001)
+        running[0] -= 1
+        return i
+
+    async def main():
+        async with Pool(3) as p:
+            for i in range(20):
+                p.spawn(g(i))
+        assert p.counter == 0
+
+        results = []
+        async for x in Pool(3).imap(g, range(20)):
+            results.append(x)
+        assert results == list(range(20))
+
+    run(main())
+
+
+def test_yielder_native():
+    async def main():
+        for cls in (Yielder, OrderedYielder):
+            y = cls(5)
+            assert y.native
+            for c in 'abcdefg':
+                y.spawn(f(c))
+            results = [x async for x in y]
+            assert sorted(results) == list('abcdefg')
+            if cls is OrderedYielder:
+                assert results == list('abcdefg')
+
+            # reusable after exhausted
+            y.spawn(f('h'))
+            assert [x async for x in y] == ['h']
+
+    run(main())
+
+
+def test_yielder_native_break():
+    async def main():
+        async with Yielder() as y:
+            tasks = [y.spawn(f(i)) for i in range(10)]
+            async for x in y:
+                break
+        await asyncio.sleep(0)
+        assert sum(t.cancelled() for t in tasks) > 0
+        assert y.counter == 0
+
+    run(main())
+
+
+@raises(ValueError)
+def test_yielder_native_raise():
+    async def g(i):
+        if i == 3:
+            raise ValueError
+        return i
+
+    async def main():
+        y = Yielder()
+        for i in range(5):
+            y.spawn(g(i))
+        async for x in y:
+            pass
+
+    run(main())
+
+
+def test_native_sync_use_fails():
+    async def main():
+        for cls in (Yielder, OrderedYielder):
+            y = cls()
+            y.spawn(f(1))
+            for consume in (y.yielding, y.yielding_batches):
+                try:
+                    consume()
+                except RuntimeError:
+                    pass
+                else:
+                    assert False, 'should raise'
+            assert [x async for x in y] == [1]
+
+        errors = []
+        loop = asyncio.get_event_loop()
+        loop.set_exception_handler(lambda loop, context: errors.append(
+            context['message']))
+        g = Group()
+        g.spawn(f(1))
+        # forgot to await
+        g.join()
+        assert errors and 'never awaited' in errors[0]
+        await g.join()
+
+    run(main())
+
+
+def test_bag_keeps_own_loop():
+    async def main():
+        b = Bag()
+        assert b.loop is not asyncio.get_event_loop()
+
+    run(main())
+
+
+if __name__ == '__main__':
+    test_group_native()
+    test_pool_native_async_with()
+    test_yielder_native()
+    test_yielder_native_break()
+    test_yielder_native_raise()
+    test_native_sync_use_fails()
+    test_bag_keeps_own_loop()
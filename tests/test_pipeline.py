@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import random
+import asyncio
+
+from nose.tools import raises
+
+from aioutils import Pipeline, LoopRunner
+
+
+def tracked(name, running, peaks, delay=0.005):
+    @asyncio.coroutine
+    def f(x):
+        running[name] = running.get(name, 0) + 1
+        peaks[name] = max(peaks.get(name, 0), running[name])
+        yield from asyncio.sleep(random.random() * delay)
+        running[name] -= 1
+        return x + name
+    return f
+
+
+def test_pipeline():
+    running = {}
+    peaks = {}
+    p = Pipeline()
+    p.stage(tracked('a', running, peaks), concurrency=8)
+    p.stage(tracked('b', running, peaks), concurrency=2)
+    p.stage(tracked('c', running, peaks), concurrency=4, ordered=True)
+    results = list(p.yielding(str(i) for i in range(100)))
+    assert sorted(results) == sorted('{}abc'.format(i) for i in range(100))
+    assert peaks == {'a': 8, 'b': 2, 'c': 4}
+
+
+def test_pipeline_ordered():
+    running = {}
+    peaks = {}
+    p = Pipeline()
+    p.stage(tracked('a', running, peaks), concurrency=5, ordered=True)
+    p.stage(tracked('b', running, peaks), concurrency=5, ordered=True)
+    results = list(p.yielding(str(i) for i in range(50)))
+    assert results == ['{}ab'.format(i) for i in range(50)]
+
+
+def test_pipeline_backpressure():
+    pulled = []
+
+    def inputs():
+        for i in range(200):
+            pulled.append(i)
+            yield i
+
+    @asyncio.coroutine
+    def fast(x):
+        return x
+
+    @asyncio.coroutine
+    def slow(x):
+        yield from asyncio.sleep(0.001)
+        return x
+
+    p = Pipeline().stage(fast, concurrency=10, buffer=10)
+    p.stage(slow, concurrency=1, buffer=2)
+    for n, x in enumerate(p.yielding(inputs())):
+        # the fast stage doesn't run ahead of the slow one
+        assert len(pulled) - n <= 2 * (10 + 2)
+    assert n == 199
+
+
+def test_pipeline_break():
+    @asyncio.coroutine
+    def f(x):
+        yield from asyncio.sleep(0.001)
+        return x
+
+    p = Pipeline().stage(f, concurrency=4).stage(f, concurrency=4)
+    for x in p.yielding(range(1000)):
+        break
+    # the pipeline can run again
+    assert sorted(p.yielding(range(10))) == list(range(10))
+
+
+@raises(ValueError)
+def test_pipeline_raise():
+    @asyncio.coroutine
+    def f(x):
+        if x == 5:
+            raise ValueError
+        return x
+
+    p = Pipeline().stage(f, concurrency=4).stage(f, concurrency=2)
+    list(p.yielding(range(10)))
+
+
+def test_pipeline_runner():
+    runner = LoopRunner()
+    try:
+        @asyncio.coroutine
+        def f(x):
+            yield from asyncio.sleep(0.001)
+            return x * 2
+
+        p = Pipeline(runner=runner).stage(f, 4).stage(f, 2, ordered=True)
+        assert list(p.yielding(range(20))) == [x * 4 for x in range(20)]
+    finally:
+        runner.stop()
+
+
+if __name__ == '__main__':
+    test_pipeline()
+    test_pipeline_ordered()
+    test_pipeline_backpressure()
+    test_pipeline_break()
+    test_pipeline_raise()
+    test_pipeline_runner()
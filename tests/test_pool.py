@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
 import time
 import asyncio
+import concurrent.futures
 
-from aioutils import Group, Pool
+from aioutils import Group, Pool, Yielder
 
 def test_group():
     timespan = 0.1
@@ -43,6 +45,185 @@ def test_pool():
     print('total time: {:4.2f}'.format(time.time() - t0))
     assert timespan * 3 < time.time() - t0 < timespan * 3 * 1.1
 
+
+def test_imap():
+    pulled = []
+    finished = []
+
+    def inputs():
+        for i in range(20):
+            pulled.append(i)
+            yield i
+
+    @asyncio.coroutine
+    def f(i):
+        # never more than pool_size inputs pulled but not finished
+        assert len(pulled) - len(finished) <= 3
+        yield from asyncio.sleep(0.01 * (i % 3))
+        finished.append(i)
+        return i * 2
+
+    p = Pool(3)
+    assert list(p.imap(f, inputs())) == [i * 2 for i in range(20)]
+
+
+def test_imap_unordered():
+    @asyncio.coroutine
+    def f(a, b):
+        yield from asyncio.sleep(0.01)
+        return a + b
+
+    p = Pool(4)
+    t0 = time.time()
+    results = list(p.imap_unordered(f, range(8), range(8)))
+    assert sorted(results) == [i * 2 for i in range(8)]
+    assert 0.02 < time.time() - t0 < 0.03 * 1.5
+
+
+def test_spawn_blocking():
+    timespan = 0.05
+
+    # blocking calls count against the pool size
+    t0 = time.time()
+    p = Pool(2, executor=concurrent.futures.ThreadPoolExecutor(4))
+    for i in range(4):
+        p.spawn_blocking(time.sleep, timespan)
+    p.spawn(asyncio.sleep(timespan))
+    p.join()
+    assert timespan * 3 < time.time() - t0 < timespan * 3 * 1.5
+
+    # a process pool works too
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(2) as executor:
+        g = Group(executor=executor)
+        for i in range(4):
+            g.spawn_blocking(os.getpid).add_done_callback(
+                lambda f: results.append(f.result()))
+        g.join()
+    assert len(results) == 4 and os.getpid() not in results
+
+
+def test_fair_groups():
+    started = []
+
+    @asyncio.coroutine
+    def f(name, i):
+        started.append(name)
+        yield from asyncio.sleep(0.001)
+        return i
+
+    p = Pool(4, fair=True)
+    a = p.group('a', weight=3)
+    b = p.group('b')
+    # b spawns first and more, still gets its share only
+    for i in range(200):
+        b.spawn(f('b', i))
+    for i in range(60):
+        a.spawn(f('a', i))
+    assert sorted(a.yielding()) == list(range(60))
+    # while both were busy, a got 3 of every 4 slots
+    assert 55 <= started[4:84].count('a') <= 65
+    b.join()
+    assert len(started) == 260
+    assert p.sem.active == 0
+
+
+def test_fair_groups_share_key_limits():
+    running = [0, 0]
+
+    @asyncio.coroutine
+    def f():
+        running[0] += 1
+        running[1] = max(running)
+        yield from asyncio.sleep(0.001)
+        running[0] -= 1
+
+    p = Pool(10, fair=True, key_size=1)
+    a = p.group('a')
+    b = p.group('b')
+    for _ in range(5):
+        a.spawn(f(), key='host')
+        b.spawn(f(), key='host')
+    a.join()
+    b.join()
+    # one at a time for the host, across both groups
+    assert running[1] == 1
+
+
+def test_group_needs_fair_pool():
+    try:
+        Pool(2).group('a')
+    except ValueError:
+        pass
+    else:
+        assert False, 'should raise'
+
+
+def test_pool_spawn_many():
+    running = [0, 0]
+    done = []
+
+    @asyncio.coroutine
+    def g(x):
+        running[0] += 1
+        running[1] = max(running)
+        yield from asyncio.sleep(0.001)
+        running[0] -= 1
+        if x == 5:
+            raise ValueError
+        done.append(x)
+
+    errors = []
+    p = Pool(4)
+    p.loop.set_exception_handler(lambda loop, context: errors.append(
+        context['exception']))
+    try:
+        p.spawn_many(g(x) for x in range(50))
+        assert p.counter == 4
+        p.spawn_map(g, range(100, 110), workers=2)
+        p.join()
+    finally:
+        p.loop.set_exception_handler(None)
+    assert sorted(done) == [x for x in range(50) if x != 5] + \
+        list(range(100, 110))
+    assert running[1] == 4
+    assert len(errors) == 1 and isinstance(errors[0], ValueError)
+
+
+def test_pool_yielder_share_gates():
+    assert Pool._gate is Yielder._gate
+    # the same gates, spawned and pulled by spawn_many
+    for cls in (Pool, Yielder):
+        running = [0, 0]
+
+        @asyncio.coroutine
+        def g(x):
+            running[0] += 1
+            running[1] = max(running)
+            yield from asyncio.sleep(0.01)
+            running[0] -= 1
+            return x
+
+        p = cls(3, key_size=2, rate=1000, stats=True)
+        for x in range(5):
+            p.spawn(g(x), key=x % 2)
+        p.spawn_map(g, range(5, 10))
+        if cls is Pool:
+            p.join()
+        else:
+            assert sorted(p.yielding()) == list(range(10))
+        assert running[1] == 3
+        assert p.stats()['finished'] == 10
+
+
 if __name__ == '__main__':
     test_group()
     test_pool()
+    test_imap()
+    test_imap_unordered()
+    test_spawn_blocking()
+    test_fair_groups()
+    test_fair_groups_share_key_limits()
+    test_group_needs_fair_pool()
+    test_pool_spawn_many()
+    test_pool_yielder_share_gates()
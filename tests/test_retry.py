@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+
+from nose.tools import raises
+
+from aioutils import Pool, Yielder, OrderedYielder
+
+
+def flaky(failures, calls, result='ok', delay=0):
+    """ Coroutine function failing the first `failures` calls """
+    @asyncio.coroutine
+    def f():
+        calls.append(time.time())
+        yield from asyncio.sleep(delay)
+        if len(calls) <= failures:
+            raise ValueError(len(calls))
+        return result
+    return f
+
+
+@raises(asyncio.TimeoutError)
+def test_timeout():
+    y = Yielder(2)
+    y.spawn(asyncio.sleep(1), timeout=0.01)
+    t0 = time.time()
+    try:
+        list(y.yielding())
+    finally:
+        assert time.time() - t0 < 0.1
+
+
+def test_retries():
+    calls = []
+    y = Yielder(2)
+    y.spawn(flaky(2, calls), retries=2, backoff=0.01)
+    assert list(y.yielding()) == ['ok']
+    assert len(calls) == 3
+    # 0.01, then 0.02 seconds of backoff
+    assert calls[2] - calls[0] >= 0.03
+
+
+@raises(ValueError)
+def test_retries_exhausted():
+    calls = []
+    y = Yielder(2)
+    y.spawn(flaky(5, calls), retries=2, backoff=0)
+    try:
+        list(y.yielding())
+    finally:
+        assert len(calls) == 3
+
+
+def test_backoff_gives_up_slot():
+    order = []
+
+    @asyncio.coroutine
+    def fast():
+        order.append('fast')
+
+    calls = []
+    p = Pool(1)
+    p.spawn(flaky(1, calls), retries=1, backoff=0.05)
+    p.spawn(fast())
+    p.join()
+    # fast ran while the first task was backing off
+    assert len(calls) == 2
+    assert order == ['fast']
+    assert p.sem._value == 1
+
+
+def test_hedge_after():
+    calls = []
+
+    @asyncio.coroutine
+    def f():
+        calls.append(1)
+        # the first attempt is stuck, the hedged one is fast
+        yield from asyncio.sleep(1 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    for cls in (Yielder, OrderedYielder):
+        del calls[:]
+        y = cls(5)
+        y.spawn(f, hedge_after=0.02)
+        t0 = time.time()
+        assert list(y.yielding()) == [2]
+        assert time.time() - t0 < 0.1
+        # the loser was cancelled, nothing left holding a slot
+        assert y.sem._value == 5
+
+
+def test_hedge_after_percentile():
+    p = Pool(10)
+    calls = []
+
+    @asyncio.coroutine
+    def warmup():
+        yield from asyncio.sleep(0.01)
+
+    for _ in range(30):
+        p.spawn(warmup, hedge_after='p90')
+    p.join()
+    assert len(p.latencies.samples) == 30
+
+    @asyncio.coroutine
+    def f():
+        calls.append(1)
+        yield from asyncio.sleep(1 if len(calls) == 1 else 0.01)
+
+    t0 = time.time()
+    p.spawn(f, hedge_after='p90')
+    p.join()
+    assert len(calls) == 2
+    assert time.time() - t0 < 0.1
+
+
+@raises(ValueError)
+def test_retries_need_coroutine_function():
+    Pool(1).spawn(asyncio.sleep(0), retries=1)
+
+
+if __name__ == '__main__':
+    test_timeout()
+    test_retries()
+    test_retries_exhausted()
+    test_backoff_gives_up_slot()
+    test_hedge_after()
+    test_hedge_after_percentile()
+    test_retries_need_coroutine_function()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import random
+import asyncio
+import threading
+
+from aioutils import Group, Pool, Yielder, OrderedYielder, LoopRunner
+
+
+@asyncio.coroutine
+def f(c):
+    yield from asyncio.sleep(random.random()*0.02)
+    return c
+
+
+def test_group_runner():
+    runner = LoopRunner()
+    try:
+        g = Group(runner=runner)
+        for _ in range(3):
+            t0 = time.time()
+            for i in range(9):
+                g.spawn(asyncio.sleep(0.05))
+            g.join()
+            assert 0.05 < time.time() - t0 < 0.05 * 1.5
+        # the loop keeps running between joins
+        assert runner.loop.is_running()
+    finally:
+        runner.stop()
+
+
+def test_pool_runner():
+    runner = LoopRunner()
+    try:
+        p = Pool(3, runner=runner)
+        t0 = time.time()
+        for i in range(9):
+            p.spawn(asyncio.sleep(0.05))
+        p.join()
+        assert 0.05 * 3 < time.time() - t0 < 0.05 * 3 * 1.5
+        assert list(p.imap(f, 'abcdefg')) == list('abcdefg')
+    finally:
+        runner.stop()
+
+
+def test_yielder_runner():
+    chars = 'abcdefg'
+    runner = LoopRunner()
+
+    def gen_func(y):
+        for c in chars:
+            y.spawn(f(c))
+        y.put('z')
+        yield from y.yielding()
+
+    try:
+        y = Yielder(2, runner=runner)
+        assert set(gen_func(y)) == set(chars + 'z')
+        # break and reuse
+        for x in gen_func(y):
+            break
+        assert set(gen_func(y)) == set(chars + 'z')
+
+        y = OrderedYielder(runner=runner)
+        assert ''.join(gen_func(y)) == chars + 'z'
+    finally:
+        runner.stop()
+
+
+def test_shared_runner():
+    """ Many sync callers share one loop """
+    chars = 'abcdefg'
+    runner = LoopRunner()
+    results = []
+
+    def t():
+        y = Yielder(runner=runner)
+        for c in chars:
+            y.spawn(f(c))
+        results.append(set(y.yielding()) == set(chars))
+
+        g = Group(runner=runner)
+        for c in chars:
+            g.spawn(f(c))
+        g.join()
+        results.append(g.counter == 0)
+
+    try:
+        threads = [threading.Thread(target=t) for _ in range(5)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        assert results == [True] * 10
+    finally:
+        runner.stop()
+
+
+if __name__ == '__main__':
+    test_group_runner()
+    test_pool_runner()
+    test_yielder_runner()
+    test_shared_runner()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import random
+import asyncio
+
+from aioutils import ShardedPool, ShardedYielder
+
+from nose.tools import raises
+
+
+@asyncio.coroutine
+def f(c):
+    yield from asyncio.sleep(random.random()*0.02)
+    return c, os.getpid()
+
+
+@asyncio.coroutine
+def g(c):
+    yield from asyncio.sleep(random.random()*0.02)
+    if c == 'c':
+        raise ValueError(c)
+
+
+@asyncio.coroutine
+def h(c):
+    if c == 'c':
+        raise asyncio.CancelledError()
+    return c
+
+
+def test_sharded_pool():
+    with ShardedPool(2, pool_size=3, chunksize=2) as p:
+        for c in 'abcdefg':
+            p.spawn(f, c)
+        p.join()
+        assert p.counter == 0
+
+
+def test_sharded_yielder():
+    chars = 'abcdefghijklmn'
+    with ShardedYielder(3, chunksize=3) as y:
+        for c in chars:
+            y.spawn(f, c)
+        results = list(y.yielding())
+    assert sorted(c for c, pid in results) == list(chars)
+    # spread over the workers, none in the main process
+    pids = set(pid for c, pid in results)
+    assert len(pids) == 3 and os.getpid() not in pids
+
+
+def test_ordered_sharded_yielder():
+    chars = 'abcdefghijklmn'
+    with ShardedYielder(2, pool_size=2, ordered=True) as y:
+        for _ in range(2):
+            for c in chars:
+                y.spawn(f, c)
+            assert ''.join(c for c, pid in y.yielding()) == chars
+
+
+def test_break_from_sharded_yielder():
+    with ShardedYielder(2) as y:
+        for c in 'abcdefg':
+            y.spawn(f, c)
+        for x in y.yielding():
+            break
+        # late results of the first run are dropped
+        y.spawn(f, 'z')
+        assert [c for c, pid in y.yielding()] == ['z']
+
+
+@raises(ValueError)
+def test_raise_from_sharded_yielder():
+    with ShardedYielder(2) as y:
+        for c in 'abcdefg':
+            y.spawn(g, c)
+        list(y.yielding())
+
+
+def test_cancelled_in_sharded_yielder():
+    for ordered in (False, True):
+        with ShardedYielder(2, ordered=ordered) as y:
+            for c in 'abcde':
+                y.spawn(h, c)
+            results = list(y.yielding())
+        assert sorted(results) == ['a', 'b', 'd', 'e']
+        if ordered:
+            assert results == ['a', 'b', 'd', 'e']
+
+
+if __name__ == '__main__':
+    test_sharded_pool()
+    test_sharded_yielder()
+    test_ordered_sharded_yielder()
+    test_break_from_sharded_yielder()
+    test_raise_from_sharded_yielder()
+    test_cancelled_in_sharded_yielder()
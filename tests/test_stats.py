@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import gc
+import time
+import asyncio
+
+from nose.tools import raises
+
+from aioutils import Pool, Yielder, OrderedYielder, LoopRunner, Stats
+from aioutils.stats import Histogram, _samplers
+
+
+@asyncio.coroutine
+def f(x, delay=0.01):
+    yield from asyncio.sleep(delay)
+    if x < 0:
+        raise ValueError(x)
+    return x
+
+
+def test_histogram():
+    h = Histogram()
+    assert h.percentile(50) is None
+    for _ in range(99):
+        h.add(0.001)
+    h.add(1)
+    s = h.snapshot()
+    assert s['count'] == 100 and s['max'] == 1
+    assert 0.001 <= s['p50'] < 0.002
+    assert s['p99'] < 0.002
+    assert 1 <= h.percentile(100) < 2
+    h.add(1000)
+    assert h.percentile(100) == 1000
+
+
+def test_pool_stats():
+    p = Pool(2, stats=True)
+    for x in range(5):
+        p.spawn(f(x))
+    p.spawn(f(-1))
+    p.join()
+    s = p.stats()
+    assert s['spawned'] == s['started'] == 6
+    assert s['finished'] == 5 and s['failed'] == 1
+    assert s['in_flight'] == 0
+    assert s['run']['count'] == 6 and s['run']['mean'] >= 0.01
+    # two at a time: the last ones waited for two rounds
+    assert s['wait']['max'] >= 0.02
+    assert Pool(2).stats() is None
+
+
+def test_yielder_stats_hooks():
+    events = []
+    stats = Stats(on_spawn=lambda: events.append('spawn'),
+                  on_start=lambda wait: events.append('start'),
+                  on_done=lambda run, exc: events.append(exc is None))
+    for cls in (Yielder, OrderedYielder):
+        y = cls(1, stats=stats, on_error='yield')
+        y.spawn(f(1))
+        y.spawn(f(-1))
+        assert y.stats()['in_flight'] == 2
+        results = list(y.yielding())
+        assert results[0] == 1 and isinstance(results[1], ValueError)
+        assert y.stats()['buffered'] == 0
+    assert events == ['spawn', 'spawn', 'start', True, 'start', False] * 2
+    assert stats.failed == 2
+
+
+def test_map_stats():
+    y = Yielder(3, stats=True)
+    assert sorted(y.map(f, range(10))) == list(range(10))
+    s = y.stats()
+    assert s['started'] == s['finished'] == 10
+
+
+def test_loop_lag():
+    runner = LoopRunner()
+    try:
+        y = Yielder(stats=Stats(lag_interval=0.01), runner=runner)
+
+        @asyncio.coroutine
+        def block():
+            time.sleep(0.05)
+
+        y.spawn(block())
+        list(y.yielding())
+        time.sleep(0.05)
+        lag = y.stats()['loop_lag']
+        assert lag['count'] >= 2
+        assert lag['max'] >= 0.03
+    finally:
+        y.metrics.close()
+        runner.stop()
+
+
+def test_loop_lag_sampler_shared():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def main():
+        pools = [Pool(5, stats=Stats(lag_interval=0.01)) for _ in range(200)]
+        # a single timer for all of them
+        sampler, = _samplers[loop].values()
+        assert len(sampler.watchers) == 200
+        await asyncio.sleep(0.03)
+        assert all(p.stats()['loop_lag']['count'] >= 1 for p in pools)
+        del pools
+        gc.collect()
+        await asyncio.sleep(0.03)
+        # stopped once the pools are gone
+        assert not sampler.armed and loop not in _samplers
+
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+        asyncio.set_event_loop(asyncio.new_event_loop())
+
+
+@raises(ValueError)
+def test_stats_failed_tasks_raise():
+    p = Pool(2, stats=True)
+    task = p.spawn(f(-1))
+    p.join()
+    assert p.stats()['failed'] == 1
+    task.result()
+
+
+if __name__ == '__main__':
+    test_histogram()
+    test_pool_stats()
+    test_yielder_stats_hooks()
+    test_map_stats()
+    test_loop_lag()
+    test_loop_lag_sampler_shared()
+    test_stats_failed_tasks_raise()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+
+from nose.tools import raises
+
+from aioutils import Yielder, OrderedYielder, yielding
+
+
+async def pages(name, n, delay=0.01, log=None):
+    try:
+        for i in range(n):
+            await asyncio.sleep(delay)
+            if log is not None:
+                log.append((name, i))
+            yield '{}{}'.format(name, i)
+    finally:
+        if log is not None:
+            log.append((name, 'closed'))
+
+
+def test_stream_items_as_they_come():
+    y = Yielder()
+    y.spawn_stream(pages('a', 5, 0.02))
+    t0 = time.time()
+    times = []
+    results = []
+    for x in y.yielding():
+        times.append(time.time() - t0)
+        results.append(x)
+    assert results == ['a0', 'a1', 'a2', 'a3', 'a4']
+    # the first page is not held back until the last one
+    assert times[0] < 0.04 and times[-1] > 0.09
+
+
+def test_ordered_streams():
+    @asyncio.coroutine
+    def f():
+        return 'f'
+
+    y = OrderedYielder()
+    log = []
+    y.spawn(pages('a', 3, 0.02, log))
+    y.spawn_stream(pages('b', 3, 0.001, log))
+    y.spawn(f())
+    results = []
+    for x in y.yielding():
+        if x == 'a0':
+            # b is done long before, but waits behind a
+            assert ('b', 2) in log
+        results.append(x)
+    assert results == ['a0', 'a1', 'a2', 'b0', 'b1', 'b2', 'f']
+
+
+def test_stream_holds_slot():
+    log = []
+    y = Yielder(1)
+    y.spawn(pages('a', 3, 0.005, log))
+    y.spawn(pages('b', 3, 0.005, log))
+    assert len(list(y.yielding())) == 6
+    assert [name for name, _ in log] == ['a'] * 4 + ['b'] * 4
+
+
+def test_stream_max_buffered():
+    log = []
+    with yielding(max_buffered=2) as y:
+        y.spawn(pages('a', 20, 0, log))
+        for x in y:
+            # the generator does not run ahead of the consumer
+            assert len(log) - int(x[1:]) <= 3
+    assert len(log) == 21
+
+
+def test_ordered_stream_max_buffered():
+    @asyncio.coroutine
+    def head():
+        yield from asyncio.sleep(0.05)
+        return 'head'
+
+    log = []
+    y = OrderedYielder(max_buffered=2)
+    y.spawn(head())
+    y.spawn(pages('a', 500, 0, log))
+    results = []
+    for x in y.yielding():
+        if x == 'head':
+            # the stream behind the slow head waited for room meanwhile
+            assert len(log) <= 3
+        results.append(x)
+    assert results[0] == 'head' and len(results) == 501
+
+
+def test_stream_priority():
+    log = []
+    y = Yielder(1, prioritized=True)
+    y.spawn(pages('a', 2, 0.005, log), priority=5)
+    y.spawn(pages('b', 2, 0.005, log), priority=1)
+    y.spawn(pages('c', 2, 0.005, log), priority=0)
+    assert len(list(y.yielding())) == 6
+    # a got the free slot first, then by priority
+    assert [name for name, _ in log][::3] == ['a', 'c', 'b']
+
+
+@raises(ValueError)
+def test_stream_options_rejected():
+    Yielder().spawn(pages('a', 1), timeout=0.1)
+
+
+def test_stream_closed_on_break():
+    log = []
+    y = OrderedYielder()
+    y.spawn_stream(pages('a', 100, 0.001, log))
+    for x in y.yielding():
+        break
+    y.loop.run_until_complete(asyncio.sleep(0.01))
+    assert log[-1] == ('a', 'closed')
+    assert len(log) < 10
+
+
+if __name__ == '__main__':
+    test_stream_items_as_they_come()
+    test_ordered_streams()
+    test_stream_holds_slot()
+    test_stream_max_buffered()
+    test_ordered_stream_max_buffered()
+    test_stream_priority()
+    test_stream_options_rejected()
+    test_stream_closed_on_break()
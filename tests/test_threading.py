@@ -4,7 +4,9 @@ import time
 import random
 import asyncio
 import threading
-from aioutils import Group, Yielder, yielding
+from aioutils import Group, Pool, Yielder, OrderedYielder, yielding
+from aioutils import LoopRunner
+from aioutils.runner import Inbox
 
 @asyncio.coroutine
 def f(c):
@@ -119,8 +121,70 @@ def test_yielding_size_in_threading():
     assert set(l) == set(chars)
 
 
+def producers(target, n=4):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(n)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+
+def test_inbox_batches():
+    loop = asyncio.new_event_loop()
+    flushes = []
+    calls = []
+    inbox = Inbox(loop, lambda: flushes.append(len(calls)))
+    try:
+        producers(lambda i: [inbox.submit(calls.append, i)
+                             for _ in range(100)])
+        assert len(inbox) == 400
+        loop.run_until_complete(asyncio.sleep(0, loop=loop))
+        # a single wakeup for all of them
+        assert flushes == [400] and len(inbox) == 0
+    finally:
+        loop.close()
+
+
+def test_yielder_threadsafe():
+    runner = LoopRunner()
+    try:
+        for cls in (Yielder, OrderedYielder):
+            y = cls(10, runner=runner)
+
+            def produce(i):
+                for j in range(100):
+                    y.spawn_threadsafe(f((i, j)))
+                    y.put_threadsafe((i, 'put', j))
+
+            producers(produce)
+            results = list(y.yielding())
+            assert len(results) == 800
+            assert sorted(x for x in results if x[1] != 'put') == \
+                [(i, j) for i in range(4) for j in range(100)]
+    finally:
+        runner.stop()
+
+
+def test_group_threadsafe():
+    done = []
+
+    @asyncio.coroutine
+    def g(x):
+        yield from asyncio.sleep(0.001)
+        done.append(x)
+
+    # the loop of the main thread is not running, join runs what came in
+    for group in (Group(), Pool(5)):
+        del done[:]
+        producers(lambda i: [group.spawn_threadsafe(g(i))
+                             for _ in range(50)])
+        group.join()
+        assert len(done) == 200 and group.counter == 0
+
+
 if __name__ == '__main__':
     test_group_threading()
     test_yielder_threading()
     test_mixed()
     test_yielding_size_in_threading()
+    test_inbox_batches()
+    test_yielder_threadsafe()
+    test_group_threadsafe()
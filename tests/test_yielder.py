@@ -107,6 +107,17 @@ def test_yielder_with_pool_size():
     assert set(gen_func())  == set(chars)
 
 
+def test_yielder_zero_pool_size():
+    # 0 means no limit, not a semaphore nobody can acquire
+    for y in (Yielder(0), OrderedYielder(0)):
+        for i in range(3):
+            y.spawn(f(i))
+        assert sorted(y.yielding()) == [0, 1, 2]
+    with yielding(0) as y:
+        y.spawn(f('a'))
+        assert list(y) == ['a']
+
+
 def test_empty_yielder():
     def gen_func():
         with yielding() as y:
@@ -190,13 +201,446 @@ def test_raise_from_nested_yielding():
         pass
 
 
+def test_yielding_batches():
+    chars = 'abcdefghijklmn'
+    def gen_func():
+        with yielding(max_batch=4, linger=0.05) as y:
+            for c in chars:
+                y.spawn(f(c))
+            yield from y.yielding_batches()
+
+    batches = list(gen_func())
+    assert all(0 < len(batch) <= 4 for batch in batches)
+    assert sorted(c for batch in batches for c in batch) == list(chars)
+
+
+def test_ordered_yielding_batches():
+    chars = 'abcdefghijklmn'
+    def gen_func():
+        y = OrderedYielder(max_batch=3)
+        for c in chars:
+            y.spawn(f(c))
+        yield from y.yielding_batches()
+
+    batches = list(gen_func())
+    assert all(0 < len(batch) <= 3 for batch in batches)
+    assert ''.join(c for batch in batches for c in batch) == chars
+
+
+def test_yielder_linger():
+    @asyncio.coroutine
+    def g(i):
+        yield from asyncio.sleep(0.01 * i)
+        return i
+
+    stops = []
+    y = Yielder(linger=0.2)
+    y._stop_loop = lambda f: (stops.append(f), y.loop.stop())
+    for i in range(10):
+        y.spawn(g(i))
+    assert sorted(y.yielding()) == list(range(10))
+    # all results arrive within the linger window, only one hand off
+    assert len(stops) == 1
+
+
+def test_yielder_map():
+    inputs = iter(range(100))
+
+    def gen_func():
+        y = Yielder(5)
+        yield from y.map(f, inputs)
+
+    g = gen_func()
+    first = next(g)
+    # inputs are pulled lazily
+    assert len(list(inputs)) > 50
+    assert 0 <= first < 100
+    g.close()
+
+
+def test_ordered_yielder_map():
+    def gen_func():
+        y = OrderedYielder()
+        y.put('z')
+        yield from y.map(f, 'abcdefg', limit=3)
+
+    assert ''.join(gen_func()) == 'zabcdefg'
+
+
+@raises(ValueError)
+def test_map_without_limit():
+    Yielder().map(f, 'abc')
+
+
+def test_yielder_max_buffered():
+    y = Yielder(max_buffered=3)
+    started = []
+
+    @asyncio.coroutine
+    def g(i):
+        started.append(i)
+        yield from asyncio.sleep(0)
+        return i
+
+    for i in range(20):
+        y.spawn(g(i))
+
+    results = []
+    for x in y.yielding():
+        # slow consumer, producers must not run ahead of it
+        assert len(y.done) + y.reserved <= 3
+        assert len(started) - len(results) <= 3 * 2
+        results.append(x)
+        time.sleep(0.001)
+    assert sorted(results) == list(range(20))
+
+
+def test_yielder_max_buffered_bounds_done():
+    for cls in (Yielder, OrderedYielder):
+        y = cls(max_buffered=2)
+        peaks = []
+
+        @asyncio.coroutine
+        def g(i):
+            yield from asyncio.sleep(0.001 * (i % 3))
+            peaks.append(len(y.done))
+            return i
+
+        for i in range(30):
+            y.spawn(g(i))
+        assert sorted(y.yielding()) == list(range(30))
+        # this result still has to fit in
+        assert max(peaks) <= 1
+
+
+def test_yielder_max_buffered_after_break():
+    started = []
+
+    @asyncio.coroutine
+    def g(i):
+        started.append(i)
+        yield from asyncio.sleep(0.001)
+        return i
+
+    y = Yielder(max_buffered=3)
+    for i in range(10):
+        y.spawn(g(i))
+    for x in y.yielding():
+        break
+    # reservations of the cancelled tasks don't leak into the next run
+    del started[:]
+    for i in range(10):
+        y.spawn(g(i))
+    for n, x in enumerate(y.yielding()):
+        assert len(started) - n <= 3
+        assert y.reserved >= 0
+    assert n == 9
+
+
+def test_yielder_aput_at_capacity():
+    @asyncio.coroutine
+    def g(i):
+        yield from asyncio.sleep(0.01 if i else 0.05)
+        yield from y.aput(i)
+        yield from y.aput(i + 100)
+
+    # every running task puts while they hold all the room
+    y = Yielder(max_buffered=2)
+    for i in range(4):
+        y.spawn(g(i))
+    assert sorted(y.yielding()) == [0, 1, 2, 3, 100, 101, 102, 103]
+    y = Yielder(2, max_buffered=2)
+    y.spawn_map(g, range(4))
+    assert sorted(y.yielding()) == [0, 1, 2, 3, 100, 101, 102, 103]
+
+    # the slow head too, puts of a task are yielded in its place
+    y = OrderedYielder(max_buffered=2)
+    for i in range(4):
+        y.spawn(g(i))
+    assert list(y.yielding()) == [0, 100, 1, 101, 2, 102, 3, 103]
+    y = OrderedYielder(2, max_buffered=2)
+    y.spawn_map(g, range(4))
+    assert list(y.yielding()) == [0, 100, 1, 101, 2, 102, 3, 103]
+
+
+def test_ordered_yielder_max_buffered():
+    chars = 'abcdefghijklmn'
+
+    def gen_func():
+        with ordered_yielding(2, max_buffered=4) as y:
+            @asyncio.coroutine
+            def g(c):
+                yield from y.aput(c)
+                yield from y.aput(c.upper())
+
+            for c in chars:
+                y.spawn(f(c))
+            y.spawn(g('z'))
+            yield from y
+
+    gs = ''.join(gen_func())
+    assert gs[:len(chars)] == chars
+    assert sorted(gs[len(chars):]) == ['Z', 'z']
+
+
+def test_ordered_yielder_window():
+    started = []
+
+    @asyncio.coroutine
+    def g(i):
+        started.append(i)
+        # the first one is a straggler
+        yield from asyncio.sleep(0.05 if i == 0 else 0.001)
+        return i
+
+    def gen_func():
+        y = OrderedYielder(window=4)
+        for i in range(20):
+            y.spawn(g(i))
+        yield from y.yielding()
+
+    for i, x in enumerate(gen_func()):
+        assert i == x
+        assert max(started) < i + 4
+
+
+def test_ordered_yielder_window_smaller_than_batch():
+    y = OrderedYielder(window=2, max_batch=10)
+    for i in range(20):
+        y.spawn(f(i))
+    batches = list(y.yielding_batches())
+    assert sum(batches, []) == list(range(20))
+    assert max(len(batch) for batch in batches) <= 2
+
+
+def test_ordered_yielder_head_timeout():
+    chars = 'abcdefg'
+
+    @asyncio.coroutine
+    def g(c):
+        yield from asyncio.sleep(1 if c == 'c' else 0.01)
+        return c
+
+    def gen_func(policy):
+        with ordered_yielding(head_timeout=0.05, head_policy=policy,
+                              placeholder='-') as y:
+            for c in chars:
+                y.spawn(g(c))
+            yield from y
+
+    t0 = time.time()
+    assert ''.join(gen_func('cancel')) == 'ab-defg'
+    assert time.time() - t0 < 0.1
+
+    g2 = gen_func('skip')
+    assert ''.join(next(g2) for _ in range(len(chars))) == 'ab-defg'
+    assert time.time() - t0 < 0.2
+    # the straggler still runs, but its result is dropped
+    assert list(g2) == []
+
+
+def test_yielder_spawn_blocking():
+    def blocking(c):
+        time.sleep(0.01)
+        return c.upper()
+
+    def gen_func():
+        with ordered_yielding(2) as y:
+            for c in 'abc':
+                y.spawn_blocking(blocking, c)
+                y.spawn(f(c))
+            yield from y
+
+    assert ''.join(gen_func()) == 'AaBbCc'
+
+
+def test_yielder_drops_finished_tasks():
+    @asyncio.coroutine
+    def g(i):
+        yield from asyncio.sleep(0)
+        return i
+
+    for cls in (Yielder, OrderedYielder):
+        y = cls(5)
+        n = 0
+        for x in y.map(g, range(500)):
+            # at most the feeder and the running tasks
+            assert len(y.tasks) <= 6
+            n += 1
+        assert n == 500 and not y.tasks
+
+        for i in range(20):
+            y.spawn(g(i))
+        for x in y.yielding():
+            break
+        assert y.counter == 0 and not y.tasks
+        # the callbacks of cancelled tasks don't disturb the next run
+        for i in range(10):
+            y.spawn(g(i))
+        assert sorted(y.yielding()) == list(range(10))
+
+
+@asyncio.coroutine
+def fail_or_sleep(i):
+    if i == 3:
+        yield from asyncio.sleep(0.01)
+        raise ValueError(i)
+    yield from asyncio.sleep(0.5 if i > 3 else 0)
+    return i
+
+
+def test_yielder_fail_fast():
+    for cls in (Yielder, OrderedYielder):
+        y = cls(on_error='fail_fast')
+        tasks = [y.spawn(fail_or_sleep(i)) for i in range(20)]
+        t0 = time.time()
+        results = []
+        try:
+            for x in y.yielding():
+                results.append(x)
+        except ValueError:
+            pass
+        else:
+            assert False, 'should raise'
+        assert time.time() - t0 < 0.1
+        assert results == [0, 1, 2]
+        assert all(t.cancelled() for t in tasks[4:])
+
+        # usable again
+        y.spawn(fail_or_sleep(0))
+        assert list(y.yielding()) == [0]
+
+
+def test_yielder_yield_exceptions():
+    @asyncio.coroutine
+    def g(i):
+        if i % 2:
+            raise ValueError(i)
+        return i
+
+    y = OrderedYielder(on_error='yield')
+    for i in range(6):
+        y.spawn(g(i))
+    results = list(y.yielding())
+    assert results[::2] == [0, 2, 4]
+    assert [e.args[0] for e in results[1::2]] == [1, 3, 5]
+
+    y = Yielder(2, on_error='yield')
+    results = list(y.map(g, range(6)))
+    assert len(results) == 6
+    assert sum(isinstance(x, ValueError) for x in results) == 3
+
+
+def test_yielder_max_exceptions():
+    @asyncio.coroutine
+    def g(i):
+        if i:
+            raise ValueError(i)
+        yield from asyncio.sleep(0.05)
+        return i
+
+    y = Yielder(max_exceptions=2)
+    for i in range(10):
+        y.spawn(g(i))
+    gen = y.yielding()
+    assert next(gen) == 0
+    assert [e.args[0] for e in y.exceptions] == [1, 2]
+    try:
+        next(gen)
+    except ValueError as e:
+        assert e.args[0] == 1
+    else:
+        assert False, 'should raise'
+
+
+@raises(ValueError)
+def test_yielder_unknown_on_error():
+    Yielder(on_error='ignore')
+
+
+def test_yielder_spawn_many():
+    running = [0, 0]
+
+    @asyncio.coroutine
+    def g(x):
+        running[0] += 1
+        running[1] = max(running)
+        yield from asyncio.sleep(random.random() * 0.01)
+        running[0] -= 1
+        return x
+
+    y = Yielder(3)
+    y.spawn_many(g(x) for x in range(50))
+    y.spawn(g(50))
+    assert sorted(y.yielding()) == list(range(51))
+    assert running[1] == 3
+    # 3 workers and the task, not a task per coroutine
+    y.spawn_map(g, range(10))
+    assert y.counter == 3
+    assert sorted(y.yielding()) == list(range(10))
+
+
+def test_ordered_yielder_spawn_many():
+    y = OrderedYielder(5, on_error='yield')
+
+    @asyncio.coroutine
+    def g(x):
+        yield from asyncio.sleep(random.random() * 0.01)
+        if x == 7:
+            raise ValueError
+        return x
+
+    y.spawn_map(g, range(20))
+    results = list(y.yielding())
+    assert isinstance(results[7], ValueError)
+    assert results[:7] + results[8:] == list(range(7)) + list(range(8, 20))
+
+
+@raises(ValueError)
+def test_yielder_spawn_many_fail_fast():
+    @asyncio.coroutine
+    def g(x):
+        yield from asyncio.sleep(0.001)
+        if x == 3:
+            raise ValueError
+        return x
+
+    y = Yielder(2, on_error='fail_fast')
+    y.spawn_map(g, range(1000))
+    list(y.yielding())
+
+
 if __name__ == '__main__':
     test_yielder()
     test_ordered_yielder()
     test_yielding()
     test_yielder_with_pool_size()
+    test_yielder_zero_pool_size()
     test_empty_yielder()
     test_two_level_ordered_yielding()
     test_break_from_yielding()
     test_raise_from_yielding()
     test_raise_from_nested_yielding()
+    test_yielding_batches()
+    test_ordered_yielding_batches()
+    test_yielder_linger()
+    test_yielder_map()
+    test_ordered_yielder_map()
+    test_map_without_limit()
+    test_yielder_max_buffered()
+    test_yielder_max_buffered_bounds_done()
+    test_yielder_max_buffered_after_break()
+    test_yielder_aput_at_capacity()
+    test_ordered_yielder_max_buffered()
+    test_ordered_yielder_window()
+    test_ordered_yielder_window_smaller_than_batch()
+    test_ordered_yielder_head_timeout()
+    test_yielder_spawn_blocking()
+    test_yielder_drops_finished_tasks()
+    test_yielder_fail_fast()
+    test_yielder_yield_exceptions()
+    test_yielder_max_exceptions()
+    test_yielder_unknown_on_error()
+    test_yielder_spawn_many()
+    test_ordered_yielder_spawn_many()
+    test_yielder_spawn_many_fail_fast()